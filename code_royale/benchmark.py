@@ -0,0 +1,176 @@
+"""
+Per-turn latency benchmark for the bots.
+
+Replays recorded referee inputs (the `test_*.txt` dumps, and the turns of a local referee
+game for late-game positions) through `GameState.update_from_input`, `queen_action`
+and `train_action`, then reports latency percentiles and allocations per turn.
+
+Usage:
+    python code_royale/benchmark.py --repeat 2000
+    python code_royale/benchmark.py --check  # non-zero exit code when a p99 is over budget
+"""
+import argparse
+import dataclasses
+import os
+import sys
+import time
+import tracemalloc
+from typing import List, Optional, Tuple
+
+from referee import Bot, Referee
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+TURN_BUDGET_MS = 50.
+
+BRONZE = os.path.join(HERE, 'bronze', 'first_wave.py')
+WOOD_3 = os.path.join(HERE, 'wood_3_league', 'first_wave.py')
+
+# (bot, recorded input)
+CASES: List[Tuple[str, str]] = [
+    (WOOD_3, os.path.join(HERE, 'wood_3_league', 'test_first_wave.txt')),
+    (WOOD_3, os.path.join(HERE, 'wood_3_league', 'test_league.txt')),
+    (WOOD_3, os.path.join(HERE, 'wood_3_league', 'test_want_to_build.txt')),
+    (BRONZE, os.path.join(HERE, 'wood_1_league', 'test_first_wave.txt')),
+    (BRONZE, os.path.join(HERE, 'wood_3_league', 'test_league.txt')),
+    (BRONZE, os.path.join(HERE, 'wood_3_league', 'test_want_to_build.txt')),
+]
+# Seed of the referee game replayed for each bot
+REFEREE_SEED = 1
+
+
+@dataclasses.dataclass
+class Recording:
+    name: str
+    init_lines: List[str]
+    turns: List[List[str]]
+
+
+@dataclasses.dataclass
+class Measure:
+    name: str
+    bot: str
+    samples_ms: List[float]
+    # peak memory allocated during a turn
+    alloc_bytes: float
+    # blocks still alive after the turn
+    alloc_blocks: float
+
+    def percentile(self, p: float) -> float:
+        ordered = sorted(self.samples_ms)
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+    def __str__(self):
+        return (
+            f'{os.path.relpath(self.bot, HERE):28} {self.name:40}'
+            f' p50={self.percentile(50):7.3f}ms p99={self.percentile(99):7.3f}ms max={max(self.samples_ms):7.3f}ms'
+            f' alloc_peak={self.alloc_bytes / 1024:6.1f}KiB retained={self.alloc_blocks:4.0f} blocks'
+        )
+
+
+def load_recording(path: str) -> Recording:
+    with open(path) as f:
+        lines = [line.strip() for line in f if line.strip()]
+
+    num_sites = int(lines[0])
+    init_lines = lines[:num_sites + 1]
+    turns = []
+    i = num_sites + 1
+    while i + num_sites + 1 < len(lines):
+        num_units = int(lines[i + num_sites + 1])
+        end = i + num_sites + 2 + num_units
+        if end > len(lines):
+            break  # The dump was cut mid-turn
+        turns.append(lines[i:end])
+        i = end
+    return Recording(name=os.path.relpath(path, HERE), init_lines=init_lines, turns=turns)
+
+
+def record_referee_game(bot_path: str, seed: int) -> Recording:
+    # Inputs received by player 0 during a mirror game, covers the late game that the dumps don't
+    referee = Referee((bot_path, bot_path), seed)
+    turns = []
+    bot = referee.bots[0]
+    original_turn = bot.turn
+
+    def recording_turn(turn: int, lines: List[str]) -> List[str]:
+        turns.append(list(lines))
+        return original_turn(turn, lines)
+
+    bot.turn = recording_turn
+    referee.play()
+    return Recording(name=f'referee seed={seed}', init_lines=referee.init_input(), turns=turns)
+
+
+def run_turn(bot: Bot, lines: List[str]):
+    bot.feed(lines)
+    state = bot.state
+    state.update_from_input()
+    state.queen_action()
+    state.train_action()
+
+
+def measure(bot_path: str, recording: Recording, repeat: int) -> Optional[Measure]:
+    if not recording.turns:
+        return None
+    bot = Bot(bot_path, player=0)
+    bot.start(recording.init_lines)
+
+    samples = []
+    for _ in range(max(1, repeat // len(recording.turns))):
+        for lines in recording.turns:
+            start = time.perf_counter()
+            run_turn(bot, lines)
+            samples.append((time.perf_counter() - start) * 1000)
+
+    # Separate pass: tracing allocations slows everything down
+    tracemalloc.start()
+    total_bytes = 0
+    total_blocks = 0
+    for lines in recording.turns:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        current, _ = tracemalloc.get_traced_memory()
+        run_turn(bot, lines)
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+        total_bytes += peak - current
+        total_blocks += sum(max(s.count_diff, 0) for s in after.compare_to(before, 'lineno'))
+    tracemalloc.stop()
+
+    return Measure(
+        name=recording.name,
+        bot=bot_path,
+        samples_ms=samples,
+        alloc_bytes=total_bytes / len(recording.turns),
+        alloc_blocks=total_blocks / len(recording.turns),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the bots turn latency on recorded inputs')
+    parser.add_argument('--repeat', type=int, default=1000, help='number of turns to time per case')
+    parser.add_argument('--budget', type=float, default=TURN_BUDGET_MS, help='turn budget in ms for --check')
+    parser.add_argument('--check', action='store_true', help='fail when a p99 is over the budget')
+    args = parser.parse_args()
+
+    recordings = [(bot, load_recording(path)) for bot, path in CASES]
+    recordings.extend((bot, record_referee_game(bot, REFEREE_SEED)) for bot in (WOOD_3, BRONZE))
+
+    over_budget = []
+    for bot, recording in recordings:
+        result = measure(bot, recording, args.repeat)
+        if result is None:
+            continue
+        print(result)
+        if result.percentile(99) > args.budget:
+            over_budget.append(result)
+
+    if over_budget:
+        print(f'{len(over_budget)} case(s) over the {args.budget}ms budget')
+        if args.check:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
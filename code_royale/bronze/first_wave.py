@@ -1,13 +1,27 @@
 import dataclasses
+import heapq
+import itertools
 import sys
 import math
+import os
+import time
+import traceback
+import tracemalloc
+import zlib
 
 from enum import IntEnum
 from operator import attrgetter
-from typing import List, Dict, Optional
+from typing import Callable, FrozenSet, List, Dict, Iterator, Optional, Set, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 
 DEBUG = False
+# Read the turn as blocks of bytes from sys.stdin.buffer instead of one input() per line
+FAST_INPUT = True
 
 
 class StructureType(IntEnum):
@@ -76,32 +90,310 @@ class UnitType(IntEnum):
         }
         return _training_time.get(self)
 
+    @property
+    def radius(self) -> Optional[int]:
+        _unit_radius = {
+            UnitType.Knight: 20,
+            UnitType.Archer: 25,
+            UnitType.Giant: 40,
+            UnitType.Queen: 30,
+        }
+        return _unit_radius.get(self)
+
+
+# Time we have to answer, minus some margin for the referee and the output
+FIRST_TURN_BUDGET_MS = 950.
+TURN_BUDGET_MS = 45.
+# Share of the turn given to the queen, the training gets the rest
+QUEEN_BUDGET_SHARE = 0.7
+
+# Play the first turns from OPENING_BOOK when the map is in it
+USE_OPENING_BOOK = True
+# Let planner exceptions through instead of playing the fallback command (the local referee sets it)
+RAISE_PLANNER_ERRORS = False
+
+WIDTH = 1920
+HEIGHT = 1000
+MAX_TURNS = 200
+# Distance between the edges of the queen and a site to be touching it
+TOUCH_DISTANCE = 5
+# Queen moves tried when running away, in 16 directions
+EVADE_STEPS = tuple(
+    (int(round(speed * math.cos(a * math.pi / 8))), int(round(speed * math.sin(a * math.pi / 8))))
+    for a in range(16)
+    for speed in (UnitType.Queen.speed,)
+)
+# Where the queens usually start, planned for before the first turn
+START_CORNERS = ((200, 200), (200, HEIGHT - 200), (WIDTH - 200, 200), (WIDTH - 200, HEIGHT - 200))
+TOWER_HP_MAX = 800
+# Tower area (beyond the site) per HP
+TOWER_HP_TO_AREA = 1000
+# Damage to the queen is 1 at the edge of a tower range, one more every 200 closer to the tower
+TOWER_DAMAGE_DROP_DISTANCE = 200
+# Creep damage per turn once in contact: knights to the queen, giants to towers
+KNIGHT_DAMAGE = 1
+GIANT_DAMAGE = 80
+
+# No per instance __dict__ for the objects we keep a lot of (python >= 3.10)
+SLOTS = {'slots': True} if sys.version_info >= (3, 10) else {}
+
 
 def neg_is_none(value: int) -> Optional[int]:
     return value if value >= 0 else None
 
 
-def debug(msg: str):
-    if DEBUG:
-        print(f"D {msg}", file=sys.stderr, flush=True)
+class LogLevel(IntEnum):
+    Debug = 10
+    Info = 20
+    Warning = 30
+    Off = 100
+
+
+# Minimum level logged per category, None is the default for all categories.
+# Change them at runtime with set_log_level or with BOT_LOG="build=debug,input=debug".
+LOG_LEVELS: Dict[Optional[str], LogLevel] = {None: LogLevel.Debug if DEBUG else LogLevel.Info}
+
+
+def set_log_level(level: LogLevel, category: str = None):
+    LOG_LEVELS[category] = level
+
+
+def log_enabled(level: LogLevel, category: str = None) -> bool:
+    return level >= LOG_LEVELS.get(category, LOG_LEVELS[None])
+
 
+def _load_log_levels(setting: str):
+    for item in setting.split(','):
+        if '=' in item:
+            category, level = item.split('=', 1)
+            try:
+                level = LogLevel[level.strip().capitalize()]
+            except KeyError:
+                # A typo must not kill the bot, the log sink does not exist yet
+                print(f'W Unknown log level in BOT_LOG: {item.strip()!r}', file=sys.stderr, flush=True)
+                continue
+            set_log_level(level, category.strip() or None)
+
+
+_load_log_levels(os.environ.get('BOT_LOG', ''))
 
-def info(msg: str):
-    print(f"I {msg}", file=sys.stderr, flush=True)
 
+class LogSink:
+    # Keeps the turn's log lines and writes them with a single print once the commands are out.
+    # The referee truncates long outputs: above max_bytes the lowest levels are dropped first.
 
-def warning(msg: str):
-    info('====')
-    info(msg)
-    info('====')
+    def __init__(self, max_bytes: int = 4000, buffered: bool = True):
+        self.max_bytes = max_bytes
+        self.buffered = buffered
+        self.entries: List[Tuple[LogLevel, str]] = []
+        self.size = 0
+        # Lines of the turn dropped so far
+        self.dropped = 0
+
+    def write(self, level: LogLevel, line: str):
+        if not self.buffered:
+            print(line, file=sys.stderr, flush=True)
+            return
+        self.entries.append((level, line))
+        self.size += len(line) + 1
+        if self.size > 4 * self.max_bytes:
+            # Do not grow for ever on a chatty turn
+            self.dropped += self._trim(2 * self.max_bytes)
+
+    def _trim(self, max_bytes: int) -> int:
+        if self.size <= max_bytes:
+            return 0
+        # Most important then oldest first
+        kept = set()
+        size = 0
+        for i in sorted(range(len(self.entries)), key=lambda i: (-self.entries[i][0], i)):
+            line_size = len(self.entries[i][1]) + 1
+            if size + line_size <= max_bytes:
+                kept.add(i)
+                size += line_size
+        dropped = len(self.entries) - len(kept)
+        self.entries = [e for i, e in enumerate(self.entries) if i in kept]
+        self.size = size
+        return dropped
+
+    def flush(self):
+        if not self.entries and not self.dropped:
+            return
+        dropped = self.dropped + self._trim(self.max_bytes)
+        lines = [line for _, line in self.entries]
+        if dropped:
+            lines.append(f'... {dropped} log lines dropped')
+        print('\n'.join(lines), file=sys.stderr, flush=True)
+        self.entries = []
+        self.size = 0
+        self.dropped = 0
+
+
+LOG_SINK = LogSink()
+
+
+def _log(prefix: str, level: LogLevel, category: Optional[str], msg: str, args: tuple):
+    # msg is only %-formatted when the category logs at that level
+    if level < LOG_LEVELS.get(category, LOG_LEVELS[None]):
+        return
+    if args:
+        msg = msg % args
+    LOG_SINK.write(level, f"{prefix} {msg}")
+
+
+def debug(msg: str, *args, category: str = None):
+    _log('D', LogLevel.Debug, category, msg, args)
+
+
+def info(msg: str, *args, category: str = None):
+    _log('I', LogLevel.Info, category, msg, args)
+
+
+def warning(msg: str, *args, category: str = None):
+    if log_enabled(LogLevel.Warning, category):
+        info('====', category=category)
+        _log('I', LogLevel.Warning, category, msg, args)
+        info('====', category=category)
+
+
+class _Phase:
+
+    def __init__(self, profiler: "Profiler", name: str):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0.
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, (time.perf_counter() - self.start) * 1000)
+
+
+class _NoPhase:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+class Profiler:
+    # Named timers per phase of the turn, with an optional tracemalloc peak per turn
+    buckets_ms = (0.05, 0.1, 0.5, 1., 5., 10., 50.)
+
+    def __init__(self, enabled: bool = False, trace_memory: bool = False):
+        self.enabled = enabled
+        self.trace_memory = trace_memory
+        # phase: duration in ms of each turn
+        self.samples: Dict[str, List[float]] = {}
+        self.turn: Dict[str, float] = {}
+        self.memory_peaks: List[int] = []
+        self._no_phase = _NoPhase()
+
+    def phase(self, name: str):
+        if not self.enabled:
+            return self._no_phase
+        return _Phase(self, name)
+
+    def record(self, name: str, duration_ms: float):
+        if self.enabled:
+            self.turn[name] = self.turn.get(name, 0.) + duration_ms
+
+    def start_turn(self):
+        self.turn = {}
+        if self.enabled and self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+
+    def end_turn(self, turns: int):
+        if not self.enabled or not self.turn:
+            return
+        peak = None
+        if self.trace_memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            peak -= current
+            self.memory_peaks.append(peak)
+        for name, duration in self.turn.items():
+            self.samples.setdefault(name, []).append(duration)
+        summary = ' '.join(f'{name}={duration:.2f}' for name, duration in self.turn.items())
+        info('T%d %s ms%s', turns, summary, f' peak={peak / 1024:.1f}KiB' if peak is not None else '', category='profile')
+
+    @classmethod
+    def histogram(cls, samples: Dict[str, List[float]]) -> str:
+        # One line per phase: number of turns in each duration bucket and the worst one
+        header = ' '.join(f'<{b:g}ms'.rjust(8) for b in cls.buckets_ms)
+        lines = [f'{"phase":12} {header} {">=":>5}{cls.buckets_ms[-1]:g}ms      max']
+        for name, values in samples.items():
+            counts = [0] * (len(cls.buckets_ms) + 1)
+            for v in values:
+                for i, bucket in enumerate(cls.buckets_ms):
+                    if v < bucket:
+                        counts[i] += 1
+                        break
+                else:
+                    counts[-1] += 1
+            lines.append(f'{name:12} {" ".join(str(c).rjust(8) for c in counts)} {max(values):8.2f}')
+        return '\n'.join(lines)
+
+
+# Set PROFILER.enabled (and trace_memory) to get the per turn timings in the logs
+PROFILER = Profiler()
 
 
 def log_input(input_str: str):
-    if DEBUG:
-        print(input_str, file=sys.stderr, flush=True)
+    if log_enabled(LogLevel.Debug, 'input'):
+        LOG_SINK.write(LogLevel.Debug, input_str)
 
 
-@dataclasses.dataclass
+class Deadline:
+
+    def __init__(self, budget_ms: float, start: float = None):
+        self.start = time.perf_counter() if start is None else start
+        self.end = self.start + budget_ms / 1000
+
+    def __str__(self):
+        return f'{self.elapsed_ms:.1f}ms elapsed, {self.remaining_ms:.1f}ms left'
+
+    @property
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.start) * 1000
+
+    @property
+    def remaining_ms(self) -> float:
+        return max(self.end - time.perf_counter(), 0.) * 1000
+
+    @property
+    def expired(self) -> bool:
+        return time.perf_counter() >= self.end
+
+    def share(self, ratio: float) -> "Deadline":
+        # A deadline using ratio of the time left
+        return Deadline(self.remaining_ms * ratio)
+
+
+def run_anytime(deadline: Deadline, fallback: str, plans: Iterator[str]) -> str:
+    # plans yields better and better commands, we keep the last one we had time to get
+    best = fallback
+    try:
+        for command in plans:
+            if command is not None:
+                best = command
+            if deadline.expired:
+                info('Out of time (%s): %s', deadline, best, category='time')
+                break
+    except Exception:
+        if RAISE_PLANNER_ERRORS:
+            raise
+        # Better a poor command than a crash
+        warning('Planner failed, playing %s\n%s', best, traceback.format_exc().rstrip(), category='time')
+    return best
+
+
+@dataclasses.dataclass(**SLOTS)
 class Coordinate:
     x: int
     y: int
@@ -110,7 +402,11 @@ class Coordinate:
         return f'({self.x}, {self.y})'
 
     def distance(self, other: "Coordinate"):
-        return math.sqrt((other.x - self.x)**2 + (other.y - self.y)**2)
+        return math.hypot(other.x - self.x, other.y - self.y)
+
+    def squared_distance(self, other: "Coordinate"):
+        # No sqrt: good enough to compare distances
+        return (other.x - self.x) ** 2 + (other.y - self.y) ** 2
 
     def manhattan(self, other: "Coordinate"):
         # Cheaper, maybe better?
@@ -145,7 +441,7 @@ class Coordinate:
     max_distance = 1920 * 1000
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(**SLOTS)
 class BuildingSite(Coordinate):
     site_id: int
     radius: int
@@ -203,7 +499,7 @@ class BuildingSite(Coordinate):
             return f'{self.site_id_str} {self.structure.name} income={self.income} max_size={self.max_mine_size}'
         return f'{self.site_id_str} {self.structure.name} {self.owner.name} {Coordinate.__str__(self)}'
 
-    def update(self, **kwargs):
+    def update(self, **kwargs) -> List[str]:
         change = []
         for f in dataclasses.fields(self):
             v = kwargs.get(f.name)
@@ -212,6 +508,7 @@ class BuildingSite(Coordinate):
                 change.append(f.name)
         # if change:
         #     debug(f'{self.site_id_str} changed {", ".join(change)} {self}')
+        return change
 
     @classmethod
     def from_input(cls, input_str: str) -> "BuildingSite":
@@ -225,7 +522,7 @@ class BuildingSite(Coordinate):
         )
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(**SLOTS)
 class Unit(Coordinate):
     unit_type: UnitType
     owner: OwnerType
@@ -238,15 +535,93 @@ class Unit(Coordinate):
     def from_input(cls, input_str: str) -> "Unit":
         # unit_type: -1 = QUEEN, 0 = KNIGHT, 1 = ARCHER
         # x, y, owner, unit_type, health = [int(j) for j in input().split()]
-        input_list = [int(j) for j in input_str.split()]
+        return cls.from_values([int(j) for j in input_str.split()])
+
+    @classmethod
+    def from_values(cls, input_list: List[int], offset: int = 0) -> "Unit":
         return cls(
-            x=input_list[0],
-            y=input_list[1],
-            owner=OwnerType(input_list[2]),
-            unit_type=UnitType(input_list[3]),
-            health=input_list[4],
+            x=input_list[offset],
+            y=input_list[offset + 1],
+            owner=OwnerType(input_list[offset + 2]),
+            unit_type=UnitType(input_list[offset + 3]),
+            health=input_list[offset + 4],
         )
 
+    def set_values(self, input_list: List[int], offset: int = 0):
+        # Recycle the unit instead of allocating a new one
+        self.x = input_list[offset]
+        self.y = input_list[offset + 1]
+        self.owner = OwnerType(input_list[offset + 2])
+        self.unit_type = UnitType(input_list[offset + 3])
+        self.health = input_list[offset + 4]
+
+
+class SiteEventType(IntEnum):
+    Captured = 0  # owner flipped from one player to the other
+    Built = 1  # new structure on the site, maybe replacing another one
+    Destroyed = 2
+    MineExhausted = 3
+    Levelled = 4  # same structure and owner, other mine income or tower range
+
+
+@dataclasses.dataclass
+class SiteEvent:
+    event_type: SiteEventType
+    site: BuildingSite
+    previous_owner: OwnerType
+    previous_structure: StructureType
+
+    def __str__(self):
+        return (
+            f'{self.event_type.name} {self.site.site_id_str} '
+            f'{self.previous_owner.name}-{self.previous_structure.name} => {self.site}'
+        )
+
+    @classmethod
+    def from_change(
+        cls,
+        site: BuildingSite,
+        change: List[str],
+        previous_owner: OwnerType,
+        previous_structure: StructureType,
+        previous_gold: Optional[int],
+    ) -> List["SiteEvent"]:
+        events = []
+
+        def add(event_type: SiteEventType):
+            events.append(cls(event_type, site, previous_owner, previous_structure))
+
+        if 'structure' in change:
+            if site.structure == StructureType.NoStructure:
+                if previous_structure == StructureType.Goldmine and site.gold == 0:
+                    add(SiteEventType.MineExhausted)
+                else:
+                    add(SiteEventType.Destroyed)
+            else:
+                add(SiteEventType.Built)
+        elif 'param_2' in change and site.structure == StructureType.Barracks:
+            add(SiteEventType.Built)  # other barrack type
+        elif (
+            'owner' in change and previous_owner != OwnerType.NoOwner
+            and site.owner != OwnerType.NoOwner
+        ):
+            add(SiteEventType.Built)  # same kind of structure rebuilt by the other player
+        elif (
+            (site.structure == StructureType.Goldmine and 'param_1' in change)
+            or (site.structure == StructureType.Tower and 'param_2' in change)
+        ):
+            add(SiteEventType.Levelled)
+
+        if 'owner' in change and OwnerType.NoOwner not in (previous_owner, site.owner):
+            add(SiteEventType.Captured)
+
+        if (
+            'gold' in change and site.gold == 0 and previous_gold
+            and site.structure == StructureType.Goldmine
+        ):
+            add(SiteEventType.MineExhausted)
+        return events
+
 
 class Command:
 
@@ -281,20 +656,122 @@ class Command:
         return 'TRAIN'  # if it contains a space it confuses the parser
 
 
+class TrainingKnapsack:
+    # Which barracks to trigger with the gold we have: a knapsack over the creep types, where taking
+    # a type n times means its n best ready barracks. Costs are multiples of cost_step, so for every
+    # budget the few combinations worth trying (those no other creep fits on top of) are listed once.
+    types = (UnitType.Knight, UnitType.Archer, UnitType.Giant)
+    cost_step = 20
+    # More barracks of a type than that are trained as if there were that many
+    max_barracks = 6
+
+    def __init__(self):
+        costs = [t.cost // self.cost_step for t in self.types]
+        self.max_budget = self.max_barracks * sum(costs)
+        # budget -> counts per type, in the order of types
+        self.combos: List[List[Tuple[int, ...]]] = [[] for _ in range(self.max_budget + 1)]
+        for counts in itertools.product(range(self.max_barracks + 1), repeat=len(self.types)):
+            cost = sum(c * n for c, n in zip(costs, counts))
+            # Cheapest creep we could still add to it
+            room = min(
+                (c for c, n in zip(costs, counts) if n < self.max_barracks),
+                default=self.max_budget + 1,
+            )
+            for budget in range(cost, min(cost + room, self.max_budget + 1)):
+                self.combos[budget].append(counts)
+
+    def solve(self, gold: int, available: Tuple[int, ...], values: Tuple[float, ...]) -> Tuple[int, ...]:
+        # How many barracks of each type to trigger, for the best total value, spending the most on ties
+        budget = max(0, min(gold // self.cost_step, self.max_budget))
+        best = None
+        best_key = None
+        # Creeps worth nothing are not trained at all
+        available = tuple(a if v > 0 else 0 for a, v in zip(available, values))
+        for counts in self.combos[budget]:
+            counts = tuple(min(n, a) for n, a in zip(counts, available))
+            key = (
+                sum(n * v for n, v in zip(counts, values)),
+                sum(n * t.cost for n, t in zip(counts, self.types)),
+            )
+            if best_key is None or key > best_key:
+                best, best_key = counts, key
+        return best or (0,) * len(self.types)
+
+
+TRAINING_KNAPSACK = TrainingKnapsack()
+
+
+@dataclasses.dataclass(frozen=True)
+class DummyParams:
+    # The Dummy's thresholds, with the range the tuner (code_royale/tuner.py) searches
+    min_archer_barracks: int = dataclasses.field(default=1, metadata={'bounds': (0, 3)})
+    min_knight_barracks: int = dataclasses.field(default=2, metadata={'bounds': (0, 4)})
+    min_giant_barracks: int = dataclasses.field(default=1, metadata={'bounds': (0, 2)})
+    # Another archer barracks when there are more knight barracks than this per archer one
+    knights_per_archer: int = dataclasses.field(default=2, metadata={'bounds': (1, 5)})
+    # Mines with at most that income are improved
+    improve_mine_income_le: int = dataclasses.field(default=4, metadata={'bounds': (0, 4)})
+    # A tower for every that many barracks
+    barracks_per_tower: int = dataclasses.field(default=2, metadata={'bounds': (1, 6)})
+    # Mines wanted per knight barracks before building more knight barracks
+    mines_per_knight_barracks: int = dataclasses.field(default=2, metadata={'bounds': (0, 5)})
+    # Run away when the knights would deal at least evade_damage to the queen in the next evade_turns
+    evade_turns: int = dataclasses.field(default=3, metadata={'bounds': (0, 8)})
+    evade_damage: int = dataclasses.field(default=2, metadata={'bounds': (1, 10)})
+    # Mines are judged on the gold they yield over that many turns
+    economy_turns: int = dataclasses.field(default=20, metadata={'bounds': (5, 60)})
+    # How much further than the closest free site the queen walks to stay on her side of the map
+    side_slack: int = dataclasses.field(default=400, metadata={'bounds': (0, 1000), 'step': 50})
+    # Value of a training of each creep type, in units per turn of barracks time
+    knight_value: float = dataclasses.field(default=1., metadata={'bounds': (0.25, 4.), 'step': 0.25})
+    archer_value: float = dataclasses.field(default=2., metadata={'bounds': (0., 8.), 'step': 0.5})
+    archer_value_per_damage: float = dataclasses.field(default=0.5, metadata={'bounds': (0., 2.), 'step': 0.25})
+    giant_value: float = dataclasses.field(default=8., metadata={'bounds': (0., 20.), 'step': 1.})
+
+    @classmethod
+    def bounds(cls) -> List[Tuple[float, float]]:
+        return [f.metadata['bounds'] for f in dataclasses.fields(cls)]
+
+    @classmethod
+    def steps(cls) -> List[float]:
+        # Smallest change worth trying on each parameter
+        return [f.metadata.get('step', 1) for f in dataclasses.fields(cls)]
+
+    def to_vector(self) -> Tuple[float, ...]:
+        return dataclasses.astuple(self)
+
+    @classmethod
+    def from_vector(cls, vector) -> "DummyParams":
+        # Rounded to the steps and clipped to the bounds
+        values = []
+        for v, f in zip(vector, dataclasses.fields(cls)):
+            low, high = f.metadata['bounds']
+            step = f.metadata.get('step', 1)
+            values.append(f.type(min(max(low + round((v - low) / step) * step, low), high)))
+        return cls(*values)
+
+
 class Dummy:
+    params = DummyParams()
 
     @classmethod
     def want_barrack(cls, state: "GameState"):
         barrack_type = None
 
-        info(f'Choosing what barrack to build from {({k: len(v.barracks) for k, v in state.unit_info.items()})}')
+        if log_enabled(LogLevel.Info, 'build'):
+            info(
+                'Choosing what barrack to build from %s',
+                {k: len(v.barracks) for k, v in state.unit_info.items()},
+                category='build',
+            )
+        params = cls.params
         n_archer = len(state.unit_info[UnitType.Archer].barracks)
         n_knights = len(state.unit_info[UnitType.Knight].barracks)
-        if n_archer < 1 or n_knights > n_archer * 2:
+        if n_archer < params.min_archer_barracks or n_knights > n_archer * params.knights_per_archer:
             barrack_type = UnitType.Archer
-        elif n_knights < 2:
+        elif n_knights < params.min_knight_barracks:
             barrack_type = UnitType.Knight
-        elif len(state.unit_info[UnitType.Giant].barracks) < 1:
+        elif len(state.unit_info[UnitType.Giant].barracks) < params.min_giant_barracks:
             barrack_type = UnitType.Giant
 
         return barrack_type
@@ -302,7 +779,7 @@ class Dummy:
     @classmethod
     def want_building(cls, state: "GameState"):
         closest_empty = state.touched_site
-        debug(f'Touching {closest_empty}')
+        debug('Touching %s', closest_empty, category='build')
 
         # if (
         #     closest_empty is not None and
@@ -314,51 +791,86 @@ class Dummy:
         #     return Command.build_mine(closest_empty)
 
         if closest_empty is None or closest_empty.owner != OwnerType.NoOwner:
-            # No touching a site that is ours, look for one
+            # No touching a site that is ours, look for one: on my side of the map, unless it is a long way further
             closest_empty = state.closest_building_to_queen(not_owner=OwnerType.Friendly)
+            my_side = state.closest_site_on_my_side()
+            if (
+                my_side is not None and closest_empty is not None
+                and my_side.distance_from_my_queen <= closest_empty.distance_from_my_queen + cls.params.side_slack
+            ):
+                closest_empty = my_side
 
         if closest_empty:
-            debug(f'Choosing what to build on {closest_empty}')
+            debug('Choosing what to build on %s', closest_empty, category='build')
             mines = state.get_sites(owner=OwnerType.Friendly, structure=StructureType.Goldmine)
             # towers = state.get_sites(owner=OwnerType.Friendly, structure=BuildingsType.Tower)
-            expected_income = sum((m.income for m in mines))
+            economy = state.economy
+            turns = cls.params.economy_turns
+            # Gold per turn, counting the mines running dry
+            expected_income = economy.income(mines, turns)
+            new_mine_gain = economy.mine_gain(closest_empty, turns, state.queen_turns_to(closest_empty))
 
             if not state.unit_info[UnitType.Archer].barracks:
                 # Defensive: start with archers
                 return Command.build_barracks(closest_empty, UnitType.Archer)
 
-            if expected_income == 0:
-                debug('We have no income!')
+            if expected_income < 1 and new_mine_gain > 0:
+                debug('We have no income!', category='build')
                 return Command.build_mine(closest_empty)
 
-            improvable_mines = state.get_sites(owner=OwnerType.Friendly, income_le=4)
+            improvable_mines = [
+                (economy.mine_gain(m, turns, state.queen_turns_to(m)), -m.distance_from_my_queen, m.site_id, m)
+                for m in state.get_sites(owner=OwnerType.Friendly, income_le=cls.params.improve_mine_income_le)
+            ]
+            improvable_mines = [m for m in improvable_mines if m[0] > 0]
             if improvable_mines:
-                closest_empty = sorted(improvable_mines, key=attrgetter('distance_from_my_queen'))[0]
-                info(f'Improving one of the {len(improvable_mines)} mines: => {closest_empty}')
+                gain, _, _, closest_empty = max(improvable_mines)
+                info(
+                    'Improving one of the %d mines: => %s (+%d gold)', len(improvable_mines), closest_empty, gain,
+                    category='build',
+                )
                 return Command.build_mine(closest_empty)
 
             barrack_type = cls.want_barrack(state)
 
             if barrack_type is not None:
-                debug(f'Building a BARRACK-{barrack_type.name.upper()} on {closest_empty}')
+                debug('Building a BARRACK-%s on %s', barrack_type.name.upper(), closest_empty, category='build')
                 return Command.build_barracks(closest_empty, barrack_type)
 
             my_towers = state.get_sites(owner=OwnerType.Friendly, structure=StructureType.Tower)
             if (
-                2 * len(my_towers) < len(state.get_sites(owner=OwnerType.Friendly, structure=StructureType.Barracks))
+                cls.params.barracks_per_tower * len(my_towers)
+                < len(state.get_sites(owner=OwnerType.Friendly, structure=StructureType.Barracks))
             ):
                 return Command.build_tower(closest_empty)
 
             # TODO(tr) Improve tower ranges
 
-            if len(mines) < len(state.unit_info[UnitType.Knight].barracks) * 2:
+            lasting_mines = sum(1 for m in mines if economy.lasts(m, turns))
+            if (
+                lasting_mines < len(state.unit_info[UnitType.Knight].barracks) * cls.params.mines_per_knight_barracks
+                and new_mine_gain > 0
+            ):
                 return Command.build_mine(closest_empty)
             else:
-                debug('Knight barrack default')
+                debug('Knight barrack default', category='build')
                 return Command.build_barracks(closest_empty, UnitType.Knight)
             # We could also recycle old mines
 
-            debug(f'Ignoring {closest_empty}')
+            debug('Ignoring %s', closest_empty, category='build')
+
+    def plan_queen(self, state: "GameState") -> Iterator[str]:
+        # Anytime planners yield their best command so far and refine it while state.deadline allows
+        yield self.queen_action(state)
+
+    def plan_train(self, state: "GameState") -> Iterator[str]:
+        yield self.train_action(state)
+
+    def threat(self, state: "GameState") -> Optional[Unit]:
+        # The knight to run from, when all the knights coming would hurt the queen enough
+        if state.threats.queen_damage(self.params.evade_turns) < self.params.evade_damage:
+            return None
+        return state.closest_enemy()
 
     def queen_action(self, state: "GameState") -> str:
         # dummy: we're closed to an empty site: build something
@@ -367,61 +879,563 @@ class Dummy:
             return build_command
 
         # Nowhere to go, more logic to avoid enemy (maybe do that first?)
-        closest_enemy = state.closest_enemy()
-        if closest_enemy and state.my_queen.distance(closest_enemy) < (UnitType.Queen.speed * 3):
-            debug(f'Evading from {closest_enemy}')
-            return Command.move_to(state.my_queen.get_away(closest_enemy))
+        threat = self.threat(state)
+        if threat is not None:
+            debug('Evading from %s', threat, category='evade')
+            return Command.move_to(state.safe_move_away(threat))
 
         closest_empty = state.closest_building_to_queen(owner=OwnerType.Enemy)
         if closest_empty:
-            debug(f'Evading from enemy buildings')
-            return Command.move_to(state.my_queen.get_away(closest_empty))
+            debug('Evading from enemy buildings', category='evade')
+            return Command.move_to(state.safe_move_away(closest_empty))
 
         return Command.wait()
 
+    def training_values(self, state: "GameState") -> Dict[UnitType, float]:
+        # What training each creep type is worth this turn, 0 when we do not want it
+        enemy_towers = state.get_sites(owner=OwnerType.Enemy, structure=StructureType.Tower)
+        needed_archers = len(state.get_sites(owner=OwnerType.Enemy, structure=StructureType.Barracks))
+        archers = len(state.unit_info[UnitType.Archer].allies)
+        # Knights coming at the queen before archers trained now could be out
+        params = self.params
+        incoming = state.threats.queen_damage(UnitType.Archer.training_time + params.evade_turns)
+        return {
+            UnitType.Knight: params.knight_value,
+            UnitType.Archer: (
+                params.archer_value + params.archer_value_per_damage * incoming if archers < needed_archers else 0.
+            ),
+            UnitType.Giant: params.giant_value if enemy_towers and not state.unit_info[UnitType.Giant].allies else 0.,
+        }
+
+    def ready_barracks(self, state: "GameState", unit_type: UnitType) -> List[BuildingSite]:
+        # Best first: archers defend near my queen, knights and giants go to theirs
+        barracks = [b for b in state.unit_info[unit_type].barracks if b.training_delay == 0]
+        if unit_type == UnitType.Archer:
+            return sorted(barracks, key=attrgetter('distance_from_my_queen'))
+        return sorted(barracks, key=attrgetter('distance_from_their_queen'))
+
     def train_action(self, state: "GameState") -> str:
-        buildings: List[BuildingSite] = []
+        values = self.training_values(state)
+        ready = {t: self.ready_barracks(state, t) for t in TRAINING_KNAPSACK.types}
         gold = state.gold
+        if values[UnitType.Giant] and state.unit_info[UnitType.Giant].barracks and not ready[UnitType.Giant]:
+            # Keep enough for the giant once its barracks is ready
+            gold -= UnitType.Giant.cost
+
+        counts = TRAINING_KNAPSACK.solve(
+            gold,
+            tuple(len(ready[t]) for t in TRAINING_KNAPSACK.types),
+            tuple(values[t] * t.numbers / t.training_time for t in TRAINING_KNAPSACK.types),
+        )
+        buildings: List[BuildingSite] = []
+        for unit_type, n in zip(TRAINING_KNAPSACK.types, counts):
+            buildings.extend(ready[unit_type][:n])
+        return Command.train(buildings)
 
-        # Defensive: build archers first
-        if (
-            state.get_sites(owner=OwnerType.Enemy, structure=StructureType.Tower)
-            and not state.unit_info[UnitType.Giant].allies
-        ):
-            for b in state.unit_info[UnitType.Giant].barracks:
-                if b.training_delay == 0 and gold >= UnitType.Giant.cost:
-                    gold -= UnitType.Giant.cost
-                    buildings.append(b)
-                    break  # one at a time
-            else:
-                # TODO(tr) When saving maybe change behaviour to be less agressive and improve more
-                return Command.train(buildings)  # Saving money
 
-        if (
-            state.unit_info[UnitType.Archer].barracks
-            and len(state.unit_info[UnitType.Archer].allies) < len(state.get_sites(owner=OwnerType.Enemy, structure=StructureType.Barracks))
-        ):
-            if gold >= UnitType.Archer.cost:
-                # prioritise by proximity to my queen
-                for b in sorted(state.unit_info[UnitType.Archer].barracks, key=attrgetter('distance_from_my_queen')):
-                    if b.training_delay == 0 and gold >= UnitType.Archer.cost:
-                        gold -= UnitType.Archer.cost
-                        buildings.append(b)
-                        break  # one at a time
-                # else:
-                #     # TODO(tr) When saving maybe change behaviour to be less agressive and improve more
-                #     return Command.train(buildings)  # Saving money
-
-        if state.unit_info[UnitType.Knight].barracks:
-            # Prioritise by proximity to enemy queen
-            for b in sorted(state.unit_info[UnitType.Knight].barracks, key=attrgetter('distance_from_their_queen')):
-                if b.training_delay:
+# Personality of new games. bronze/search.py, loaded on top of this file, replaces it with its MonteCarlo search
+PERSONALITY = Dummy
+
+
+@dataclasses.dataclass
+class SiteDistances:
+    # Sites never move: all site to site distances are computed once during the first turn
+    distance: List[List[float]]
+    # For each site the other site ids, closest first
+    neighbours: List[List[int]]
+
+    @classmethod
+    def from_sites(cls, sites: List[BuildingSite]) -> "SiteDistances":
+        size = max((s.site_id for s in sites), default=-1) + 1
+        distance = [[0.] * size for _ in range(size)]
+        for a in sites:
+            for b in sites:
+                distance[a.site_id][b.site_id] = a.distance(b)
+
+        neighbours = [[] for _ in range(size)]
+        for a in sites:
+            neighbours[a.site_id] = sorted(
+                (b.site_id for b in sites if b.site_id != a.site_id),
+                key=distance[a.site_id].__getitem__,
+            )
+        return cls(distance=distance, neighbours=neighbours)
+
+
+class Economy:
+    # Gold the mines yield over the next turns: a mine gives min(income, gold left) every turn
+    # and is gone once empty. Forecasts only depend on the mine state, they are memoized on it.
+    # Gold left in the mines we cannot see (-1), they start with 100 to 300
+    unknown_gold = 200
+    max_cached = 4096
+
+    def __init__(self):
+        # (gold, income, turns, turns before the upgrade, upgraded income) -> gold mined each turn
+        self.profiles: Dict[Tuple[int, int, int, int, int], Tuple[int, ...]] = {}
+
+    def profile(self, gold: int, income: int, turns: int, delay: int = 0, upgraded: int = None) -> Tuple[int, ...]:
+        upgraded = income if upgraded is None else upgraded
+        key = (gold, income, turns, delay, upgraded)
+        profile = self.profiles.get(key)
+        if profile is None:
+            mined = []
+            for turn in range(turns):
+                mined.append(min(income if turn < delay else upgraded, gold))
+                gold -= mined[-1]
+            if len(self.profiles) >= self.max_cached:
+                del self.profiles[next(iter(self.profiles))]
+            profile = self.profiles[key] = tuple(mined)
+        return profile
+
+    def gold_left(self, site: BuildingSite) -> int:
+        return self.unknown_gold if site.gold is None or site.gold < 0 else site.gold
+
+    def mined(self, mine: BuildingSite, turns: int) -> int:
+        return sum(self.profile(self.gold_left(mine), mine.income or 0, turns))
+
+    def income(self, mines: List[BuildingSite], turns: int) -> float:
+        # Average gold per turn from the mines over the next turns
+        return sum(self.mined(m, turns) for m in mines) / turns
+
+    def lasts(self, mine: BuildingSite, turns: int) -> bool:
+        # Keeps its income for all the turns
+        return self.gold_left(mine) >= (mine.income or 0) * turns
+
+    def mine_gain(self, site: BuildingSite, turns: int, delay: int = 0) -> int:
+        # Extra gold over the next turns from a mine built (or improved) on site in delay turns
+        gold = self.gold_left(site)
+        if site.owner == OwnerType.Friendly and site.structure == StructureType.Goldmine:
+            income = site.income
+            upgraded = min(income + 1, site.max_mine_size or income + 1)
+        else:
+            income, upgraded = 0, 1
+        before = self.profile(gold, income, turns)
+        after = self.profile(gold, income, turns, delay, upgraded)
+        return sum(after) - sum(before)
+
+
+@dataclasses.dataclass
+class TowerCoverage:
+    # Attack radius of a tower on each site, every `step` HP
+    radius: List[List[int]]
+    step = 100
+
+    @staticmethod
+    def attack_radius(site_radius: int, hp: int) -> int:
+        return int(math.sqrt((hp * TOWER_HP_TO_AREA + math.pi * site_radius ** 2) / math.pi))
+
+    @classmethod
+    def from_sites(cls, sites: List[BuildingSite]) -> "TowerCoverage":
+        size = max((s.site_id for s in sites), default=-1) + 1
+        radius = [[] for _ in range(size)]
+        for site in sites:
+            radius[site.site_id] = [cls.attack_radius(site.radius, hp) for hp in range(0, TOWER_HP_MAX + 1, cls.step)]
+        return cls(radius=radius)
+
+
+class ThreatMap:
+    # Damage the enemy towers deal to our queen, on a coarse grid of the arena.
+    # A tower is only stamped again when its owner, structure or attack radius changed.
+    cell = 40
+
+    def __init__(self):
+        self.columns = math.ceil(WIDTH / self.cell)
+        self.rows = math.ceil(HEIGHT / self.cell)
+        self.damage = [0] * (self.columns * self.rows)
+        # site_id -> attack radius, (cell index, damage) added by the tower
+        self.stamps: Dict[int, Tuple[int, List[Tuple[int, int]]]] = {}
+        # Bumped on every change, and the version that last changed each cell
+        self.version = 0
+        self.changed_at = [0] * (self.columns * self.rows)
+
+    def _stamp(self, site: BuildingSite, radius: int) -> List[Tuple[int, int]]:
+        cell = self.cell
+        half = cell // 2
+        stamp = []
+        for row in range(max((site.y - radius) // cell, 0), min((site.y + radius) // cell + 1, self.rows)):
+            dy = row * cell + half - site.y
+            for column in range(max((site.x - radius) // cell, 0), min((site.x + radius) // cell + 1, self.columns)):
+                d = math.hypot(column * cell + half - site.x, dy)
+                if d <= radius:
+                    stamp.append((row * self.columns + column, 1 + int((radius - d) / TOWER_DAMAGE_DROP_DISTANCE)))
+        return stamp
+
+    def set_tower(self, site: BuildingSite) -> bool:
+        # Returns whether the map changed
+        radius = None
+        if site.owner == OwnerType.Enemy and site.structure == StructureType.Tower:
+            radius = site.attack_radius
+        previous = self.stamps.get(site.site_id)
+        if (previous[0] if previous is not None else None) == radius:
+            return False
+
+        damage = self.damage
+        changed_at = self.changed_at
+        self.version += 1
+        if previous is not None:
+            for i, d in previous[1]:
+                damage[i] -= d
+                changed_at[i] = self.version
+            del self.stamps[site.site_id]
+        if radius:
+            stamp = self._stamp(site, radius)
+            for i, d in stamp:
+                damage[i] += d
+                changed_at[i] = self.version
+            self.stamps[site.site_id] = (radius, stamp)
+        return True
+
+    def cell_index(self, x: int, y: int) -> int:
+        column = min(max(int(x) // self.cell, 0), self.columns - 1)
+        row = min(max(int(y) // self.cell, 0), self.rows - 1)
+        return row * self.columns + column
+
+    def centre(self, i: int) -> Tuple[int, int]:
+        row, column = divmod(i, self.columns)
+        return column * self.cell + self.cell // 2, row * self.cell + self.cell // 2
+
+    def damage_at(self, x: int, y: int) -> int:
+        return self.damage[self.cell_index(x, y)]
+
+    def segment_damage(self, a: Coordinate, b: Coordinate) -> int:
+        # Damage of the cells crossed walking straight from a to b, sampled every half cell
+        steps = max(int(a.distance(b) / (self.cell / 2)), 1)
+        return sum(
+            self.damage_at(a.x + (b.x - a.x) * i // steps, a.y + (b.y - a.y) * i // steps)
+            for i in range(steps + 1)
+        )
+
+
+class PathFinder:
+    # A* for the queen over the ThreatMap grid: sites are obstacles, cells in enemy tower range
+    # and cells a knight reaches before the queen cost more. Paths computed without knights
+    # are cached by (start cell, target site) and kept while none of their cells changed.
+    threat_cost = 4.
+    knight_cost = 6.
+    max_cached = 256
+
+    def __init__(self, sites: List[BuildingSite], threat: ThreatMap):
+        self.threat = threat
+        size = threat.columns * threat.rows
+        self.centres = [threat.centre(i) for i in range(size)]
+        self.blocked = [False] * size
+        # Cells where the queen touches each site
+        self.goals: Dict[int, FrozenSet[int]] = {}
+        queen = UnitType.Queen.radius
+        for site in sites:
+            touching = set()
+            reach = site.radius + queen + TOUCH_DISTANCE + threat.cell
+            first = threat.cell_index(site.x - reach, site.y - reach)
+            last = threat.cell_index(site.x + reach, site.y + reach)
+            for row in range(first // threat.columns, last // threat.columns + 1):
+                offset = row * threat.columns
+                for i in range(offset + first % threat.columns, offset + last % threat.columns + 1):
+                    x, y = self.centres[i]
+                    d = math.hypot(x - site.x, y - site.y)
+                    if d < site.radius + queen:
+                        self.blocked[i] = True
+                    elif d <= reach:
+                        touching.add(i)
+            self.goals[site.site_id] = frozenset(touching)
+
+        self.neighbours: List[List[Tuple[int, float]]] = []
+        for i in range(size):
+            row, column = divmod(i, threat.columns)
+            self.neighbours.append([
+                ((row + dr) * threat.columns + column + dc, math.hypot(dr, dc) * threat.cell)
+                for dr in (-1, 0, 1)
+                for dc in (-1, 0, 1)
+                if (dr or dc) and 0 <= row + dr < threat.rows and 0 <= column + dc < threat.columns
+            ])
+        # (start cell, site_id) -> threat version, cells
+        self.paths: Dict[Tuple[int, int], Tuple[int, List[int]]] = {}
+        # Last path to each site: the queen walking it can reuse the rest of it next turn
+        self.last: Dict[int, Tuple[int, List[int]]] = {}
+        self.searches = 0
+
+    def _valid(self, version: int, cells: List[int]) -> bool:
+        changed_at = self.threat.changed_at
+        return all(changed_at[i] <= version for i in cells)
+
+    def _search(
+        self, start: int, goals: FrozenSet[int], knights: List[Unit], deadline: Deadline = None,
+    ) -> Optional[List[int]]:
+        self.searches += 1
+        damage = self.threat.damage
+        blocked = self.blocked
+        centres = self.centres
+        neighbours = self.neighbours
+        gx, gy = centres[min(goals, key=lambda i: math.hypot(
+            centres[i][0] - centres[start][0], centres[i][1] - centres[start][1],
+        ))]
+        knight_reach = [
+            (k.x, k.y, UnitType.Knight.speed, UnitType.Knight.radius + UnitType.Queen.radius) for k in knights
+        ]
+        queen_speed = UnitType.Queen.speed
+
+        best = {start: 0.}
+        came_from = {start: start}
+        walked = {start: 0.}
+        heap = [(0., start)]
+        pops = 0
+        while heap:
+            _, i = heapq.heappop(heap)
+            pops += 1
+            if deadline is not None and not pops % 256 and deadline.expired:
+                return None
+            if i in goals:
+                path = [i]
+                while i != start:
+                    i = came_from[i]
+                    path.append(i)
+                path.reverse()
+                return path
+            for n, length in neighbours[i]:
+                if blocked[n] and n not in goals:
                     continue
-                if gold < UnitType.Knight.cost:
-                    break  # cannot afford more
-                buildings.append(b)
+                distance = walked[i] + length
+                cost = best[i] + length * (1 + self.threat_cost * damage[n])
+                if knight_reach:
+                    x, y = centres[n]
+                    turns = distance / queen_speed
+                    for kx, ky, speed, reach in knight_reach:
+                        if (math.hypot(x - kx, y - ky) - reach) / speed <= turns + 1:
+                            cost += self.knight_cost * length
+                if cost < best.get(n, math.inf):
+                    best[n] = cost
+                    walked[n] = distance
+                    came_from[n] = i
+                    x, y = centres[n]
+                    heapq.heappush(heap, (cost + math.hypot(gx - x, gy - y), n))
+        return None
+
+    def path(
+        self, x: int, y: int, site: BuildingSite, knights: List[Unit], deadline: Deadline = None,
+    ) -> Optional[List[int]]:
+        # None when there is no path, or no time left to find it
+        threat = self.threat
+        start = threat.cell_index(x, y)
+        if knights:
+            cells = self._search(start, self.goals[site.site_id], knights, deadline)
+            self.last.pop(site.site_id, None)
+            return cells
+
+        last = self.last.get(site.site_id)
+        if last is not None and start in last[1] and self._valid(*last):
+            return last[1][last[1].index(start):]
+        key = (start, site.site_id)
+        cached = self.paths.get(key)
+        if cached is None or not self._valid(*cached):
+            cells = self._search(start, self.goals[site.site_id], knights, deadline)
+            if cells is None:
+                return None
+            if len(self.paths) >= self.max_cached:
+                del self.paths[next(iter(self.paths))]
+            cached = self.paths[key] = (threat.version, cells)
+        self.last[site.site_id] = cached
+        return cached[1]
 
-        return Command.train(buildings)
+
+@dataclasses.dataclass
+class MapPlan:
+    # What the first turn works out for a pair of starting corners
+    my_corner: Tuple[int, int]
+    their_corner: Tuple[int, int]
+    # Sites closer to my corner than to theirs
+    my_side: FrozenSet[int]
+
+    @classmethod
+    def from_sites(
+        cls,
+        sites: List[BuildingSite],
+        my_corner: Tuple[int, int],
+        their_corner: Tuple[int, int],
+    ) -> "MapPlan":
+        mine = Coordinate(*my_corner)
+        theirs = Coordinate(*their_corner)
+        return cls(
+            my_corner=my_corner,
+            their_corner=their_corner,
+            my_side=frozenset(s.site_id for s in sites if mine.distance(s) < theirs.distance(s)),
+        )
+
+
+@dataclasses.dataclass
+class SiteIndex:
+    # Site ids by owner, structure and barrack type, only touched when a site changes
+    by_owner: Dict[OwnerType, Set[int]] = dataclasses.field(
+        default_factory=lambda: {k: set() for k in OwnerType},
+    )
+    by_structure: Dict[StructureType, Set[int]] = dataclasses.field(
+        default_factory=lambda: {k: set() for k in StructureType},
+    )
+    by_barrack_type: Dict[UnitType, Set[int]] = dataclasses.field(
+        default_factory=lambda: {k: set() for k in UnitType if k != UnitType.Queen},
+    )
+    # The keys each site is currently stored under
+    keys: Dict[int, Tuple[OwnerType, StructureType, Optional[UnitType]]] = dataclasses.field(default_factory=dict)
+
+    indexed_fields = frozenset(('owner', 'structure', 'param_2'))
+
+    def add(self, site: BuildingSite):
+        owner, structure, barrack_type = keys = (site.owner, site.structure, site.barrack_type)
+        self.by_owner[owner].add(site.site_id)
+        self.by_structure[structure].add(site.site_id)
+        if barrack_type is not None:
+            self.by_barrack_type[barrack_type].add(site.site_id)
+        self.keys[site.site_id] = keys
+
+    def remove(self, site: BuildingSite):
+        owner, structure, barrack_type = self.keys.pop(site.site_id)
+        self.by_owner[owner].discard(site.site_id)
+        self.by_structure[structure].discard(site.site_id)
+        if barrack_type is not None:
+            self.by_barrack_type[barrack_type].discard(site.site_id)
+
+    def update(self, site: BuildingSite, change: List[str]):
+        if self.indexed_fields.intersection(change):
+            self.remove(site)
+            self.add(site)
+
+
+class ThreatEngine:
+    # When each enemy unit gets to my queen and to every site, and the damage they deal once there.
+    # Arrival times are computed for all the (unit, target) pairs in one go when first needed in the turn.
+    # Uses numpy arrays when numpy is available, plain python otherwise.
+
+    def __init__(self, sites: List[BuildingSite], use_numpy: bool = True):
+        self.use_numpy = use_numpy and np is not None
+        # Target 0 is my queen, then the sites by site_id
+        self.sites = sites
+        self.queen: Optional[Unit] = None
+        self.units: List[Unit] = []
+        # Turns before each unit touches each target, units x targets
+        self.eta = None
+        # Damage per turn of each unit once it touches each target, and turns before it dies
+        self.per_turn = None
+        self.lifetime = None
+        self.unit_type = None
+        # turns -> damage to each target within that many turns
+        self.damage: Dict[int, list] = {}
+        if self.use_numpy:
+            self.site_xy = np.array([(s.x, s.y) for s in sites], dtype=np.float64).reshape(-1, 2)
+            self.site_radius = np.array([s.radius for s in sites], dtype=np.float64)
+
+    def set_units(self, queen: Unit, units: List[Unit]):
+        # units: the enemies, their queen included
+        self.queen = queen
+        self.units = units
+        self.eta = None
+        self.damage.clear()
+
+    @staticmethod
+    def _lifetime(unit: Unit) -> int:
+        # Creeps lose 1 HP per turn, queens stay
+        return MAX_TURNS if unit.unit_type == UnitType.Queen else unit.health
+
+    def _is_target_tower(self, site: BuildingSite) -> bool:
+        return site.owner == OwnerType.Friendly and site.structure == StructureType.Tower
+
+    def _assess(self):
+        if self.eta is not None:
+            return
+        if self.use_numpy:
+            self._assess_numpy()
+        else:
+            self._assess_python()
+
+    def _assess_numpy(self):
+        units = self.units
+        n = len(units)
+        values = np.array(
+            [(u.x, u.y, u.unit_type.radius, u.unit_type.speed) for u in units], dtype=np.float64,
+        ).reshape(-1, 4)
+        target_xy = np.vstack(((self.queen.x, self.queen.y), self.site_xy))
+        target_radius = np.concatenate(((UnitType.Queen.radius,), self.site_radius))
+        delta = values[:, None, :2] - target_xy[None, :, :]
+        distance = np.sqrt((delta * delta).sum(axis=2))
+        gap = distance - values[:, 2:3] - target_radius[None, :] - TOUCH_DISTANCE
+        self.eta = np.ceil(np.maximum(gap, 0) / values[:, 3:4])
+
+        self.unit_type = unit_type = np.array([u.unit_type for u in units], dtype=np.int64)
+        self.per_turn = np.zeros_like(self.eta)
+        self.per_turn[unit_type == UnitType.Knight, 0] = KNIGHT_DAMAGE
+        # Giants go for the tower closest to them
+        towers = np.array([s.site_id + 1 for s in self.sites if self._is_target_tower(s)], dtype=np.int64)
+        giants = np.flatnonzero(unit_type == UnitType.Giant)
+        if len(towers) and len(giants):
+            closest = towers[np.argmin(distance[giants][:, towers], axis=1)]
+            self.per_turn[giants, closest] = GIANT_DAMAGE
+        self.lifetime = np.array([self._lifetime(u) for u in units], dtype=np.float64).reshape(n, 1)
+
+    def _assess_python(self):
+        targets = [(self.queen, UnitType.Queen.radius)] + [(s, s.radius) for s in self.sites]
+        towers = [s for s in self.sites if self._is_target_tower(s)]
+        self.eta = []
+        self.per_turn = []
+        for u in self.units:
+            reach = u.unit_type.radius + TOUCH_DISTANCE
+            self.eta.append([
+                math.ceil(max(u.distance(t) - reach - radius, 0) / u.unit_type.speed)
+                for t, radius in targets
+            ])
+            per_turn = [0] * len(targets)
+            if u.unit_type == UnitType.Knight:
+                per_turn[0] = KNIGHT_DAMAGE
+            elif u.unit_type == UnitType.Giant and towers:
+                per_turn[min(towers, key=u.squared_distance).site_id + 1] = GIANT_DAMAGE
+            self.per_turn.append(per_turn)
+
+    def _damage(self, turns: int) -> list:
+        # A unit touching its target on turn t >= 1 hits it every turn from t until it dies of old age
+        if turns not in self.damage:
+            self._assess()
+            if self.use_numpy:
+                last = np.minimum(self.lifetime, turns)
+                hits = np.maximum(last + 1 - np.maximum(self.eta, 1), 0)
+                self.damage[turns] = (hits * self.per_turn).sum(axis=0).tolist()
+            else:
+                damage = [0] * (len(self.sites) + 1)
+                for u, eta, per_turn in zip(self.units, self.eta, self.per_turn):
+                    last = min(self._lifetime(u), turns)
+                    for i, (t, dpt) in enumerate(zip(eta, per_turn)):
+                        if dpt:
+                            damage[i] += max(last + 1 - max(t, 1), 0) * dpt
+                self.damage[turns] = damage
+        return self.damage[turns]
+
+    def queen_damage(self, turns: int) -> float:
+        # Damage my queen takes in the next turns if she stays where she is
+        return self._damage(turns)[0]
+
+    def site_damage(self, site: BuildingSite, turns: int) -> float:
+        return self._damage(turns)[site.site_id + 1]
+
+    def _arrival(self, target: int, unit_type: Optional[UnitType]) -> Tuple[float, Optional[Unit]]:
+        self._assess()
+        if not self.units:
+            return math.inf, None
+        if self.use_numpy:
+            eta = self.eta[:, target]
+            if unit_type is not None:
+                eta = np.where(self.unit_type == unit_type, eta, np.inf)
+            i = int(np.argmin(eta))
+            return float(eta[i]), self.units[i] if eta[i] < np.inf else None
+        candidates = [
+            (eta[target], i)
+            for i, (u, eta) in enumerate(zip(self.units, self.eta))
+            if unit_type is None or u.unit_type == unit_type
+        ]
+        if not candidates:
+            return math.inf, None
+        eta, i = min(candidates)
+        return eta, self.units[i]
+
+    def queen_arrival(self, unit_type: UnitType = None) -> Tuple[float, Optional[Unit]]:
+        # Turns before the first enemy (of that type) gets to my queen, and which one
+        return self._arrival(0, unit_type)
+
+    def site_arrival(self, site: BuildingSite, unit_type: UnitType = None) -> Tuple[float, Optional[Unit]]:
+        return self._arrival(site.site_id + 1, unit_type)
 
 
 @dataclasses.dataclass
@@ -438,6 +1452,91 @@ class UnitInfo:
             if k != UnitType.Queen
         }
 
+    def clear(self):
+        self.allies.clear()
+        self.enemies.clear()
+        self.barracks.clear()
+
+
+@dataclasses.dataclass
+class OpeningBook:
+    # First queen commands on known maps, by map fingerprint and queen starting position.
+    # Kept encoded until a map is looked up.
+    entries: Dict[Tuple[str, int, int], str] = dataclasses.field(default_factory=dict)
+
+    codes = {'MINE': 'M', 'TOWER': 'T', 'BARRACKS-KNIGHT': 'K', 'BARRACKS-ARCHER': 'A', 'BARRACKS-GIANT': 'G'}
+
+    @staticmethod
+    def fingerprint(sites: List[BuildingSite]) -> str:
+        layout = ' '.join(f'{s.site_id},{s.x},{s.y},{s.radius}' for s in sorted(sites, key=attrgetter('site_id')))
+        return f'{zlib.crc32(layout.encode()):08x}'
+
+    @classmethod
+    def encode(cls, commands: List[str]) -> str:
+        # BUILD 10 MINE -> 10M, MOVE 200 300 -> @200,300, WAIT -> W, the same command 3 times -> 10M*3
+        runs = []
+        for command in commands:
+            tokens = command.split()
+            if tokens[0] == 'BUILD':
+                code = tokens[1] + cls.codes[tokens[2]]
+            elif tokens[0] == 'MOVE':
+                code = f'@{tokens[1]},{tokens[2]}'
+            else:
+                code = 'W'
+            if runs and runs[-1][0] == code:
+                runs[-1][1] += 1
+            else:
+                runs.append([code, 1])
+        return ' '.join(code if n == 1 else f'{code}*{n}' for code, n in runs)
+
+    @classmethod
+    def decode(cls, encoded: str) -> List[str]:
+        structures = {v: k for k, v in cls.codes.items()}
+        commands = []
+        for token in encoded.split():
+            code, _, n = token.partition('*')
+            if code == 'W':
+                command = Command.wait()
+            elif code.startswith('@'):
+                x, y = code[1:].split(',')
+                command = f'MOVE {x} {y}'
+            else:
+                command = f'BUILD {code[:-1]} {structures[code[-1]]}'
+            commands.extend([command] * int(n or 1))
+        return commands
+
+    @classmethod
+    def parse(cls, table: str) -> "OpeningBook":
+        # One line per entry: fingerprint x,y encoded commands
+        book = cls()
+        for line in table.strip().splitlines():
+            fingerprint, start, encoded = line.split(' ', 2)
+            x, y = start.split(',')
+            book.entries[(fingerprint, int(x), int(y))] = encoded
+        return book
+
+    @staticmethod
+    def format_entry(fingerprint: str, x: int, y: int, commands: List[str]) -> str:
+        return f'{fingerprint} {x},{y} {OpeningBook.encode(commands)}'
+
+    def get(self, fingerprint: str, x: int, y: int) -> List[str]:
+        encoded = self.entries.get((fingerprint, x, y))
+        return self.decode(encoded) if encoded is not None else []
+
+
+# Generated by code_royale/opening_book.py, do not edit by hand
+OPENING_BOOK = """
+02129b06 205,187 11A 7M*3 16K*5 14K*4 4G*2
+02129b06 1715,813 10A 6M*3 17K*5 15K*4 5G*2
+708e32f8 200,200 3A*5 8M*8 4K*2
+708e32f8 1720,800 2A*5 9M*8 5K*2
+e97f8c89 1747,792 17A 6M*3 19K*4 21G*4 23T*3
+e97f8c89 173,208 16A 7M*3 18K*4 20K*4 22G*3
+dc08f89c 239,135 11A 23M*5 12K*8 19K
+dc08f89c 1681,865 10A 22M*5 13K*8 18K
+"""
+BOOK = OpeningBook.parse(OPENING_BOOK)
+
 
 @dataclasses.dataclass
 class GameState:
@@ -450,7 +1549,35 @@ class GameState:
     their_queen: Unit = None
     unit_info: Dict[UnitType, UnitInfo] = dataclasses.field(default_factory=UnitInfo.empty_dict)
 
-    personality: Dummy = dataclasses.field(default_factory=Dummy)
+    personality: Dummy = dataclasses.field(default_factory=lambda: PERSONALITY())
+
+    turns: int = 0
+    # Started when the turn input arrives
+    deadline: Optional[Deadline] = dataclasses.field(default=None, repr=False)
+
+    site_distances: Optional[SiteDistances] = None
+    site_index: SiteIndex = dataclasses.field(default_factory=SiteIndex)
+    threats: Optional[ThreatEngine] = dataclasses.field(default=None, repr=False)
+    tower_coverage: Optional[TowerCoverage] = dataclasses.field(default=None, repr=False)
+    # MapPlan for each of the START_CORNERS, and the one matching the queens once they are known
+    map_plans: Dict[Tuple[int, int], MapPlan] = dataclasses.field(default_factory=dict, repr=False)
+    map_plan: Optional[MapPlan] = dataclasses.field(default=None, repr=False)
+    threat_map: ThreatMap = dataclasses.field(default_factory=ThreatMap, repr=False)
+    economy: Economy = dataclasses.field(default_factory=Economy, repr=False)
+    path_finder: Optional[PathFinder] = dataclasses.field(default=None, repr=False)
+    fingerprint: Optional[str] = None
+    # Queen commands of the opening book for this map, by turn
+    opening: List[str] = dataclasses.field(default_factory=list, repr=False)
+    # get_sites results, dropped whenever a site changes. Do not mutate the returned lists!
+    site_queries: Dict[tuple, List[BuildingSite]] = dataclasses.field(default_factory=dict, repr=False)
+    # What changed on the map this turn, and who wants to know
+    site_events: List[SiteEvent] = dataclasses.field(default_factory=list)
+    site_subscribers: List[Callable[[SiteEvent], None]] = dataclasses.field(default_factory=list, repr=False)
+    # FAST_INPUT: the integers of the turn, reused from one turn to the next
+    site_values: List[int] = dataclasses.field(default_factory=list, repr=False)
+    unit_values: List[int] = dataclasses.field(default_factory=list, repr=False)
+    # FAST_INPUT: units are recycled from one turn to the next, only valid for the current turn
+    unit_pool: List[Unit] = dataclasses.field(default_factory=list, repr=False)
 
     @property
     def enemies(self):
@@ -482,20 +1609,39 @@ class GameState:
         barrack_type: UnitType = None,
         income_le: int = None,
     ) -> List[BuildingSite]:
-        return [
-            s
-            for s in self.site_map.values()
-            if all((
-                (owner is None or s.owner == owner),
-                (not_owner is None or s.owner != not_owner),
-                (structure is None or s.structure == structure),
-                (not_structure is None or s.structure != not_structure),
-                # It needs to be a built to count!
-                (barrack_type is None or s.barrack_type == barrack_type),
-                # Improvable mines
-                (income_le is None or (s.income is not None and s.income <= income_le and s.income < s.max_mine_size)),
-            ))
-        ]
+        key = (owner, not_owner, structure, not_structure, barrack_type, income_le)
+        sites = self.site_queries.get(key)
+        if sites is not None:
+            return sites
+
+        index = self.site_index
+        site_ids: Optional[Set[int]] = None
+        for by_key, value in (
+            (index.by_owner, owner),
+            (index.by_structure, structure),
+            # It needs to be a built to count!
+            (index.by_barrack_type, barrack_type),
+        ):
+            if value is not None:
+                matching = by_key[value]
+                site_ids = set(matching) if site_ids is None else site_ids & matching
+        if site_ids is None:
+            site_ids = set(self.site_map)
+        if not_owner is not None:
+            site_ids -= index.by_owner[not_owner]
+        if not_structure is not None:
+            site_ids -= index.by_structure[not_structure]
+
+        sites = [self.site_map[site_id] for site_id in sorted(site_ids)]
+        if income_le is not None:
+            # Improvable mines
+            sites = [
+                s
+                for s in sites
+                if s.income is not None and s.income <= income_le and s.income < s.max_mine_size
+            ]
+        self.site_queries[key] = sites
+        return sites
 
     def get_allies(self, unit_type: UnitType) -> List[Unit]:
         return self.unit_info[unit_type].allies
@@ -504,27 +1650,145 @@ class GameState:
         return self.unit_info[unit_type].enemies
 
     def print_state(self):
+        if not log_enabled(LogLevel.Info, 'turn'):
+            return
         info(
-            f'G={self.gold} my_queen={self.my_queen} with {len(list(self.allies))} units'
-            f' and {len(self.get_sites(owner=OwnerType.Friendly))} buildings'
+            'G=%d my_queen=%s with %d units and %d buildings',
+            self.gold, self.my_queen, len(list(self.allies)), len(self.get_sites(owner=OwnerType.Friendly)),
+            category='turn',
         )
         info(
-            f'Enemy queen={self.their_queen} with {len(list(self.enemies))} units '
-            f'and {len(self.get_sites(owner=OwnerType.Enemy))} buildings'
+            'Enemy queen=%s with %d units and %d buildings',
+            self.their_queen, len(list(self.enemies)), len(self.get_sites(owner=OwnerType.Enemy)),
+            category='turn',
         )
 
     def add_site(self, site: BuildingSite):
         # debug(f'Discovering {site}')
         self.site_map[site.site_id] = site
+        self.site_index.add(site)
+        self.site_queries.clear()
+
+    def __post_init__(self):
+        self.subscribe(self._on_tower_event)
+
+    def precompute(self):
+        # Called once all the sites are known, we have 1000ms on the first turn:
+        # everything that only depends on the map is done here and looked up afterwards
+        start = time.perf_counter()
+        sites = list(self.site_map.values())
+        self.site_distances = SiteDistances.from_sites(sites)
+        # The engine indexes sites by site_id
+        self.threats = ThreatEngine([self.site_map[i] for i in range(self.num_sites)])
+        self.tower_coverage = TowerCoverage.from_sites(sites)
+        self.path_finder = PathFinder(sites, self.threat_map)
+        self.fingerprint = OpeningBook.fingerprint(sites)
+        for corner in START_CORNERS:
+            # The map is symmetric around its centre, and so are the queens
+            self.map_plans[corner] = MapPlan.from_sites(
+                sites, corner, (WIDTH - corner[0], HEIGHT - corner[1]),
+            )
+        debug('Precomputed the map in %.1fms', (time.perf_counter() - start) * 1000, category='time')
+
+    def _select_map_plan(self):
+        # First turn: the plan of the corner the queen starts in, planned now if it is not one of them
+        if self.map_plan is not None:
+            return
+        corner = min(START_CORNERS, key=lambda c: self.my_queen.squared_distance(Coordinate(*c)))
+        if self.my_queen.distance(Coordinate(*corner)) > 2 * UnitType.Queen.radius:
+            corner = (self.my_queen.x, self.my_queen.y)
+            self.map_plans[corner] = MapPlan.from_sites(
+                list(self.site_map.values()), corner, (self.their_queen.x, self.their_queen.y),
+            )
+        self.map_plan = self.map_plans[corner]
+        info(
+            'Starting from %s, %d sites on my side', corner, len(self.map_plan.my_side), category='build',
+        )
+
+    def _select_opening(self):
+        if self.turns != 1 or not USE_OPENING_BOOK:
+            return
+        self.opening = BOOK.get(self.fingerprint, self.my_queen.x, self.my_queen.y)
+        if self.opening:
+            info('Opening book: %d turns for map %s', len(self.opening), self.fingerprint, category='build')
+
+    def _opening_command(self) -> Optional[str]:
+        # Follow the book while the game goes the way it went when the book was made
+        if self.turns > len(self.opening):
+            return None
+        command = self.opening[self.turns - 1]
+        if not self._can_play(command) or self.personality.threat(self) is not None:
+            info('Leaving the opening book on turn %d', self.turns, category='build')
+            self.opening = []
+            return None
+        return command
+
+    def _can_play(self, command: str) -> bool:
+        # A recorded build still makes sense on the site as it is now
+        tokens = command.split()
+        if tokens[0] != 'BUILD':
+            return True
+        site = self.site_map[int(tokens[1])]
+        what = tokens[2]
+        if site.owner == OwnerType.Enemy and site.structure == StructureType.Tower:
+            return False
+        if what == 'MINE' and site.gold == 0:
+            return False
+        if site.owner == OwnerType.Friendly:
+            # Improving is fine, replacing one of our structures is not
+            if what == 'MINE':
+                return site.structure == StructureType.Goldmine
+            if what == 'TOWER':
+                return site.structure == StructureType.Tower
+            return site.structure == StructureType.Barracks and what == f'BARRACKS-{site.barrack_type.name.upper()}'
+        return True
+
+    def queen_turns_to(self, site: BuildingSite) -> int:
+        # Moves before my queen touches the site
+        gap = site.distance_from_my_queen - site.radius - UnitType.Queen.radius - TOUCH_DISTANCE
+        return math.ceil(max(gap, 0) / UnitType.Queen.speed)
+
+    def closest_site_on_my_side(self) -> Optional[BuildingSite]:
+        # Free (or enemy but not tower) site of my side of the map, closest to my queen
+        sites = [
+            s
+            for s in self.get_sites(not_owner=OwnerType.Friendly, not_structure=StructureType.Tower)
+            if self.on_my_side(s)
+        ]
+        if sites:
+            return min(sites, key=attrgetter('distance_from_my_queen'))
+        return None
+
+    def on_my_side(self, site: BuildingSite) -> bool:
+        return site.site_id in self.map_plan.my_side
+
+    def subscribe(self, callback: Callable[[SiteEvent], None]):
+        self.site_subscribers.append(callback)
+
+    def _on_tower_event(self, event: SiteEvent):
+        # Keeps the threat map in step with the enemy towers
+        if StructureType.Tower in (event.site.structure, event.previous_structure):
+            self.threat_map.set_tower(event.site)
+
+    def _start_turn(self):
+        self.turns += 1
+        self.deadline = Deadline(FIRST_TURN_BUDGET_MS if self.turns == 1 else TURN_BUDGET_MS)
 
     def _clear_state(self):
         self.touched_site_id = None
-        self.unit_info = UnitInfo.empty_dict()
+        self.site_events.clear()
+        for v in self.unit_info.values():
+            v.clear()
 
     def update_from_input(self):
+        if FAST_INPUT:
+            return self.update_from_block_input()
+
         self._clear_state()
 
-        input_list = [int(j) for j in game_input().split()]
+        input_str = game_input()
+        self._start_turn()
+        input_list = [int(j) for j in input_str.split()]
         self.gold = input_list[0]
 
         self.touched_site_id = neg_is_none(input_list[1])
@@ -537,20 +1801,63 @@ class GameState:
             self._update_units_from_input(game_input())
 
         self._update_distance_from_queens()
+        self._select_map_plan()
+        self._select_opening()
+
+    def update_from_block_input(self):
+        self._clear_state()
+
+        # gold, touched_site, the sites and the number of units: all known sizes, read in one go
+        values = self.site_values
+        # The turn starts when the referee input is there, decoding it is part of the turn
+        game_input_values(self.num_sites + 2, values, on_read=self._start_turn)
+        self.gold = values[0]
+        self.touched_site_id = neg_is_none(values[1])
+
+        for offset in range(2, 2 + 7 * self.num_sites, 7):
+            self._update_map_from_values(values, offset)
+
+        num_units = values[-1]
+        values = self.unit_values
+        game_input_values(num_units, values)
+        pool = self.unit_pool
+        for i in range(num_units):
+            if i < len(pool):
+                unit = pool[i]
+                unit.set_values(values, 5 * i)
+            else:
+                unit = Unit.from_values(values, 5 * i)
+                pool.append(unit)
+            self._add_unit(unit)
+
+        self._update_distance_from_queens()
+        self._select_map_plan()
+        self._select_opening()
 
     def _update_map_from_input(self, input_str: str):
         # site_id, gold, maxMineSize, structure_type, owner, param_1, param_2 = [int(j) for j in input_str.split()]
-        input_list = [int(j) for j in input_str.split()]
-
-        site = self.site_map[input_list[0]]
-        site.update(
-            gold=input_list[1],
-            max_mine_size=input_list[2],
-            structure=StructureType(input_list[3]),
-            owner=OwnerType(input_list[4]),
-            param_1=neg_is_none(input_list[5]),
-            param_2=neg_is_none(input_list[6]),
+        self._update_map_from_values([int(j) for j in input_str.split()])
+
+    def _update_map_from_values(self, input_list: List[int], offset: int = 0):
+        site = self.site_map[input_list[offset]]
+        previous_owner, previous_structure, previous_gold = site.owner, site.structure, site.gold
+        change = site.update(
+            gold=input_list[offset + 1],
+            max_mine_size=input_list[offset + 2],
+            structure=StructureType(input_list[offset + 3]),
+            owner=OwnerType(input_list[offset + 4]),
+            param_1=neg_is_none(input_list[offset + 5]),
+            param_2=neg_is_none(input_list[offset + 6]),
         )
+        if change and change != ['gold']:
+            self.site_index.update(site, change)
+            self.site_queries.clear()
+        if change:
+            for event in SiteEvent.from_change(site, change, previous_owner, previous_structure, previous_gold):
+                debug('%s', event, category='site')
+                self.site_events.append(event)
+                for callback in self.site_subscribers:
+                    callback(event)
 
         if (
             site.structure == StructureType.Barracks and site.owner == OwnerType.Friendly
@@ -559,13 +1866,17 @@ class GameState:
             self.unit_info[site.barrack_type].barracks.append(site)
 
     def _update_distance_from_queens(self):
+        self.threats.set_units(self.my_queen, list(self.enemies) + [self.their_queen])
+        my_queen = self.my_queen
+        their_queen = self.their_queen
         for b in self.site_map.values():
-            b.distance_from_my_queen = self.my_queen.distance(b)
-            b.distance_from_their_queen = self.their_queen.distance(b)
+            b.distance_from_my_queen = my_queen.distance(b)
+            b.distance_from_their_queen = their_queen.distance(b)
 
     def _update_units_from_input(self, input_str: str):
-        unit = Unit.from_input(input_str)
+        self._add_unit(Unit.from_input(input_str))
 
+    def _add_unit(self, unit: Unit):
         if unit.owner == OwnerType.Friendly:
             if unit.unit_type == UnitType.Queen:
                 self.my_queen = unit
@@ -578,35 +1889,76 @@ class GameState:
                 self.unit_info[unit.unit_type].enemies.append(unit)
 
     def closest_building_to_queen(self, owner: OwnerType=None, not_owner: OwnerType=None):
-        debug(f'Looking for closest owner={owner} not_owner={not_owner} building to the queen')
+        debug('Looking for closest owner=%s not_owner=%s building to the queen', owner, not_owner, category='build')
         # Ignore towers if possible, they hurt.
         sites = self.get_sites(owner=owner, not_owner=not_owner, not_structure=StructureType.Tower)
         if not sites:
             # Try again without ignoring towers
             sites = self.get_sites(owner=owner, not_owner=not_owner)
         if sites:
-            return sorted(sites, key=attrgetter('distance_from_my_queen'))[0]
-
-    def closest_enemy(self):
-        debug('Looking for the closest enemy')
-        # TODO(tr) We could ignore enemies that have little life
-        closest = None
-        distance = None
-        for u in self.get_enemies(unit_type=UnitType.Knight):
-            d2 = self.my_queen.distance(u)
-            # debug(f'{b} is {d2} away')
-            if closest is None or d2 < distance:
-                closest = u
-                distance = d2
-                continue
-
-        return closest
+            return min(sites, key=attrgetter('distance_from_my_queen'))
+
+    def safe_move_away(self, other: Coordinate) -> Coordinate:
+        # get_away, unless it walks into an enemy tower: then the least exposed step around the queen
+        target = self.my_queen.get_away(other)
+        threat = self.threat_map
+        if not threat.damage_at(target.x, target.y):
+            return target
+        queen = self.my_queen
+        steps = [
+            Coordinate.legitimate_coordinate(queen.x + dx, queen.y + dy)
+            for dx, dy in EVADE_STEPS
+        ]
+        return min(steps, key=lambda c: (threat.damage_at(c.x, c.y), -c.squared_distance(other)))
+
+    def route(self, command: str, deadline: Deadline = None) -> str:
+        # BUILD walks straight to the site: go around the enemy towers on the way instead
+        tokens = command.split()
+        if tokens[0] != 'BUILD':
+            return command
+        site = self.site_map[int(tokens[1])]
+        queen = self.my_queen
+        if (
+            queen.distance(site) <= site.radius + UnitType.Queen.radius + TOUCH_DISTANCE
+            or not self.threat_map.segment_damage(queen, site)
+        ):
+            return command
+        cells = self.path_finder.path(queen.x, queen.y, site, self.get_enemies(UnitType.Knight), deadline)
+        # Aim a couple of queen moves ahead on the path
+        ahead = 2 * UnitType.Queen.speed // self.threat_map.cell
+        if cells is None or len(cells) <= ahead + 1:
+            return command
+        x, y = self.threat_map.centre(cells[ahead])
+        debug('Walking around the towers to %s via %d,%d', site, x, y, category='evade')
+        return Command.move_to(Coordinate(x=x, y=y))
+
+    def closest_enemy(self) -> Optional[Unit]:
+        # The knight that gets to my queen first
+        debug('Looking for the closest enemy', category='evade')
+        return self.threats.queen_arrival(UnitType.Knight)[1]
 
     def queen_action(self) -> str:
-        return self.personality.queen_action(self)
+        command = self._opening_command()
+        if command is not None:
+            return command
+
+        deadline = self.deadline
+        self.deadline = deadline.share(QUEEN_BUDGET_SHARE)
+        try:
+            return run_anytime(self.deadline, Command.wait(), self._plan_routed_queen())
+        finally:
+            self.deadline = deadline
+
+    def _plan_routed_queen(self) -> Iterator[str]:
+        # The personality's plan, then the same plan walking around the towers if there is time left
+        command = None
+        for command in self.personality.plan_queen(self):
+            yield command
+        if command is not None:
+            yield self.route(command, self.deadline)
 
     def train_action(self) -> str:
-        return self.personality.train_action(self)
+        return run_anytime(self.deadline, Command.train([]), self.personality.plan_train(self))
 
     def choose_personality(self):
         pass  # TODO(tr) Change personality if needed
@@ -617,42 +1969,92 @@ class GameState:
 
 
 def game_input():
-    input_str = input()
+    if FAST_INPUT:
+        # Never mix input() and sys.stdin.buffer: the text layer would buffer lines we then miss
+        line = sys.stdin.buffer.readline()
+        if not line:
+            raise EOFError()
+        input_str = line.decode().rstrip('\n')
+    else:
+        input_str = input()
     log_input(input_str)
     return input_str
 
 
-def play():
+def game_input_values(num_lines: int, values: List[int], on_read: Callable[[], None] = None):
+    # Fill values with all the integers of the next num_lines lines, decoded from bytes in one pass.
+    # on_read is called once the lines arrived, before decoding them
+    readline = sys.stdin.buffer.readline
+    lines = [readline() for _ in range(num_lines)]
+    if num_lines and not lines[-1]:
+        raise EOFError()
+    if on_read is not None:
+        on_read()
+    if log_enabled(LogLevel.Debug, 'input'):
+        for line in lines:
+            log_input(line.decode().rstrip('\n'))
+    values[:] = map(int, b' '.join(lines).split())
+
+
+def init_game() -> "GameState":
     num_sites = int(game_input())
 
     state = GameState()
     for i in range(num_sites):
         site = BuildingSite.from_input(game_input())
         state.add_site(site)
+    state.precompute()
+    return state
 
-    turns = 0
-    # game loop
-    while True:
-        # touched_site: -1 if none
-        # gold, touched_site = [int(i) for i in input().split()]
-        turns += 1
-        warning(f'TURN {turns}')
+
+def play_turn(state: "GameState", turns: int):
+    # touched_site: -1 if none
+    # gold, touched_site = [int(i) for i in input().split()]
+    warning('TURN %d', turns, category='turn')
+    PROFILER.start_turn()
+    try:
         state.update_from_input()
-        state.print_state()
+        # Not counting the time spent waiting for the referee
+        PROFILER.record('parse', state.deadline.elapsed_ms)
+        with PROFILER.phase('print_state'):
+            state.print_state()
 
-        info('Checking personality')
-        state.choose_personality()
+        info('Checking personality', category='turn')
+        with PROFILER.phase('personality'):
+            state.choose_personality()
 
-        info('Choosing queen action')
+        info('Choosing queen action', category='turn')
         # First line: A valid queen action
-        queen_action = state.queen_action()
+        with PROFILER.phase('queen'):
+            queen_action = state.queen_action()
         print(queen_action)
-        info('Choosing train action')
+        info('Choosing train action', category='turn')
         # Second line: A set of training instructions
-        train_action = state.train_action()
+        with PROFILER.phase('train'):
+            train_action = state.train_action()
         print(train_action)
+        PROFILER.record('total', state.deadline.elapsed_ms)
+    finally:
+        PROFILER.end_turn(turns)
+        # Logs go out once the referee has our commands
+        LOG_SINK.flush()
+
+    # TODO(tr) if we are stuck in decision make something else...
 
-        # TODO(tr) if we are stuck in decision make something else...
+
+def play():
+    state = init_game()
+
+    turns = 0
+    # game loop
+    try:
+        while True:
+            turns += 1
+            play_turn(state, turns)
+    except EOFError:
+        # Only when replaying a recorded input
+        if PROFILER.enabled:
+            print(Profiler.histogram(PROFILER.samples), file=sys.stderr)
 
 
 if __name__ == '__main__':
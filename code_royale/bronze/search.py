@@ -0,0 +1,382 @@
+"""
+MonteCarlo search personality for the bronze bot.
+
+Kept out of first_wave.py, which has to fit in the CodinGame editor (100k characters): the
+local tools run this file in the namespace of the bot, so it uses the bot's classes as they
+are and makes MonteCarlo the personality of the new games.
+
+Usage:
+    python code_royale/tournament.py code_royale/bronze/first_wave.py+code_royale/bronze/search.py \
+        code_royale/bronze/first_wave.py --games 100
+"""
+import dataclasses
+import math
+import random
+from operator import attrgetter
+from typing import Iterator, List, Optional, Tuple
+
+
+class MovementModel:
+    # Turn by turn movement: straight towards the target at the unit speed, pushed out of the sites
+    # it would overlap and kept in the arena
+
+    def __init__(self, sites: List[BuildingSite]):
+        self.sites = [(s.x, s.y, s.radius) for s in sites]
+
+    def step(self, x: int, y: int, tx: int, ty: int, speed: int, radius: int, stop_distance: float = 0):
+        dx = tx - x
+        dy = ty - y
+        d = math.hypot(dx, dy)
+        step = min(speed, d - stop_distance)
+        if step > 0:
+            x = int(round(x + dx * step / d))
+            y = int(round(y + dy * step / d))
+
+        for sx, sy, sr in self.sites:
+            min_d = sr + radius
+            dx = x - sx
+            dy = y - sy
+            if dx * dx + dy * dy >= min_d * min_d:
+                continue
+            d = math.hypot(dx, dy)
+            if d == 0:
+                dx, dy, d = 1, 0, 1
+            x = int(math.ceil(sx + dx * min_d / d)) if dx > 0 else int(math.floor(sx + dx * min_d / d))
+            y = int(math.ceil(sy + dy * min_d / d)) if dy > 0 else int(math.floor(sy + dy * min_d / d))
+        return min(max(x, radius), WIDTH - radius), min(max(y, radius), HEIGHT - radius)
+
+
+@dataclasses.dataclass
+class Plan:
+    # A candidate queen command, in a form the rollouts can apply
+    command: str
+    site_id: Optional[int] = None
+    structure: Optional[StructureType] = None
+    barrack_type: Optional[UnitType] = None
+    move_to: Optional[Tuple[int, int]] = None
+
+    @classmethod
+    def from_command(cls, command: str) -> "Plan":
+        tokens = command.split()
+        if tokens[0] == 'BUILD':
+            what = tokens[2]
+            if what == 'MINE':
+                return cls(command, int(tokens[1]), StructureType.Goldmine)
+            elif what == 'TOWER':
+                return cls(command, int(tokens[1]), StructureType.Tower)
+            barrack_type = UnitType[what[len('BARRACKS-'):].capitalize()]
+            return cls(command, int(tokens[1]), StructureType.Barracks, barrack_type)
+        elif tokens[0] == 'MOVE':
+            return cls(command, move_to=(int(tokens[1]), int(tokens[2])))
+        return cls(command)
+
+
+class Rollout:
+    # Flat and cheap to copy forward model of what matters to the queen
+    __slots__ = (
+        'gold', 'queen_x', 'queen_y', 'queen_hp',
+        'owner', 'structure', 'level', 'barrack_type', 'attack_radius',
+        'knights', 'target', 'turn', 'done',
+    )
+
+    def __init__(self, num_sites: int):
+        self.gold = 0
+        self.queen_x = 0
+        self.queen_y = 0
+        self.queen_hp = 0
+        # Per site: -1 no owner, 0 us, 1 them / StructureType / mine income / barrack UnitType
+        self.owner = [-1] * num_sites
+        self.structure = [StructureType.NoStructure] * num_sites
+        self.level = [0] * num_sites
+        self.barrack_type: List[Optional[UnitType]] = [None] * num_sites
+        self.attack_radius = [0] * num_sites
+        # Enemy knights: x, y, hp
+        self.knights: List[List[int]] = []
+        # Build the queen is walking to
+        self.target: Optional[Plan] = None
+        self.turn = 0
+        # Turn at which the candidate plan was carried out
+        self.done = 0
+
+    def copy_from(self, other: "Rollout"):
+        # In place: the same scratch rollouts are reused for every simulation
+        self.gold = other.gold
+        self.queen_x = other.queen_x
+        self.queen_y = other.queen_y
+        self.queen_hp = other.queen_hp
+        self.owner[:] = other.owner
+        self.structure[:] = other.structure
+        self.level[:] = other.level
+        self.barrack_type[:] = other.barrack_type
+        self.attack_radius[:] = other.attack_radius
+        self.knights = [list(k) for k in other.knights]
+        self.target = other.target
+        self.turn = other.turn
+        self.done = other.done
+
+    @classmethod
+    def from_state(cls, state: "GameState") -> "Rollout":
+        rollout = cls(state.num_sites)
+        rollout.gold = state.gold
+        rollout.queen_x = state.my_queen.x
+        rollout.queen_y = state.my_queen.y
+        rollout.queen_hp = state.my_queen.health
+        for site in state.site_map.values():
+            i = site.site_id
+            rollout.owner[i] = site.owner
+            rollout.structure[i] = site.structure
+            rollout.level[i] = site.income or 0
+            rollout.barrack_type[i] = site.barrack_type
+            rollout.attack_radius[i] = site.attack_radius or 0
+        rollout.knights = [[k.x, k.y, k.health] for k in state.get_enemies(UnitType.Knight)]
+        return rollout
+
+
+class MonteCarlo(Dummy):
+    # Search personality: candidate queen commands are scored with short random rollouts
+    horizon = 12
+    max_rollouts = 600
+    candidate_sites = 5
+    # HP of a new tower
+    tower_hp = 200
+    # Chances that the random policy starts a new build on an idle turn, and that an enemy
+    # knight barracks sends a wave on a given turn
+    build_rate = 0.3
+    wave_rate = 0.15
+    # Bonus given to last turn's choice, so that the queen does not dither between two close plans,
+    # and to the Dummy's choice: the rollouts have to be clearly better to override it
+    commitment = 40.
+    heuristic_bonus = 60.
+
+    # Evaluation at the end of a rollout
+    gold_value = 0.5
+    income_value = 60.
+    queen_hp_value = 20.
+    tower_value = 30.
+    # Cost of each turn spent before the candidate is carried out
+    delay_value = 20.
+    # Value of each of our barracks of that type: the first one, then the next ones.
+    # The training heuristic relies on having one of each.
+    barrack_values = {
+        UnitType.Knight: (150., 20.),
+        UnitType.Archer: (100., 0.),
+        UnitType.Giant: (120., 0.),
+    }
+
+    def __init__(self):
+        self.rng = random.Random(0)
+        self.last_command: Optional[str] = None
+        self.movement: Optional[MovementModel] = None
+
+    def candidates(self, state: "GameState") -> List[Plan]:
+        # The Dummy knows what to build next, the rollouts are better at where and when
+        heuristic = Plan.from_command(Dummy.queen_action(self, state))
+        plans = [heuristic]
+        threat = self.threat(state)
+        if threat is not None:
+            plans.append(Plan.from_command(Command.move_to(state.safe_move_away(threat))))
+
+        # Free sites can take anything, our own ones can only be improved
+        sites = [
+            s
+            for s in state.get_sites(not_owner=OwnerType.Friendly)
+            if not (s.owner == OwnerType.Enemy and s.structure == StructureType.Tower)
+        ]
+        sites.extend(state.get_sites(owner=OwnerType.Friendly, income_le=self.params.improve_mine_income_le))
+        sites.extend(state.get_sites(owner=OwnerType.Friendly, structure=StructureType.Tower))
+        sites = sorted(sites, key=attrgetter('distance_from_my_queen'))[:self.candidate_sites]
+        wanted = heuristic.structure
+        for site in sites:
+            if site.owner != OwnerType.Friendly or site.structure == StructureType.Goldmine:
+                if site.gold != 0 and wanted in (None, StructureType.Goldmine):
+                    plans.append(Plan.from_command(Command.build_mine(site)))
+            if site.owner != OwnerType.Friendly or site.structure == StructureType.Tower:
+                if wanted in (None, StructureType.Tower):
+                    plans.append(Plan.from_command(Command.build_tower(site)))
+            if site.owner != OwnerType.Friendly and wanted in (None, StructureType.Barracks):
+                for unit_type in self.barrack_values:
+                    if heuristic.barrack_type in (None, unit_type):
+                        plans.append(Plan.from_command(Command.build_barracks(site, unit_type)))
+
+        unique = {}
+        for plan in plans:
+            unique.setdefault(plan.command, plan)
+        return list(unique.values())
+
+    def _build(self, state: "GameState", rollout: Rollout, plan: Plan):
+        i = plan.site_id
+        if rollout.owner[i] == OwnerType.Enemy and rollout.structure[i] == StructureType.Tower:
+            return
+        if plan.structure == StructureType.Goldmine:
+            if state.site_map[i].gold == 0:
+                return
+            max_mine_size = state.site_map[i].max_mine_size or 1
+            if rollout.owner[i] == OwnerType.Friendly and rollout.structure[i] == StructureType.Goldmine:
+                rollout.level[i] = min(rollout.level[i] + 1, max_mine_size)
+            else:
+                rollout.level[i] = 1
+        else:
+            rollout.level[i] = 0
+        if plan.structure == StructureType.Tower:
+            # Radius of a freshly built tower, reinforcing one only grows it a bit
+            rollout.attack_radius[i] = max(
+                rollout.attack_radius[i] if rollout.structure[i] == StructureType.Tower else 0,
+                state.tower_coverage.radius[i][self.tower_hp // TowerCoverage.step],
+            )
+        else:
+            rollout.attack_radius[i] = 0
+        rollout.owner[i] = OwnerType.Friendly
+        rollout.structure[i] = plan.structure
+        rollout.barrack_type[i] = plan.barrack_type
+
+    def _random_plan(self, state: "GameState", rollout: Rollout) -> Optional[Plan]:
+        sites = state.site_distances.neighbours[self.rng.randrange(state.num_sites)][:self.candidate_sites]
+        i = self.rng.choice(sites)
+        if rollout.owner[i] == OwnerType.Friendly and rollout.structure[i] != StructureType.Goldmine:
+            return None
+        if rollout.owner[i] == OwnerType.Friendly:
+            return Plan('', i, StructureType.Goldmine)
+        structure = self.rng.choice((StructureType.Goldmine, StructureType.Tower, StructureType.Barracks))
+        barrack_type = self.rng.choice(list(self.barrack_values)) if structure == StructureType.Barracks else None
+        return Plan('', i, structure, barrack_type)
+
+    def _step(self, state: "GameState", rollout: Rollout):
+        movement = self.movement
+        queen = UnitType.Queen
+        if rollout.target is None and self.rng.random() < self.build_rate:
+            rollout.target = self._random_plan(state, rollout)
+
+        plan = rollout.target
+        if plan is not None and plan.move_to is not None:
+            rollout.queen_x, rollout.queen_y = movement.step(
+                rollout.queen_x, rollout.queen_y, plan.move_to[0], plan.move_to[1], queen.speed, queen.radius,
+            )
+            rollout.target = None
+            if not rollout.done:
+                rollout.done = rollout.turn + 1
+        elif plan is not None and plan.site_id is not None:
+            site = state.site_map[plan.site_id]
+            reach = site.radius + queen.radius + TOUCH_DISTANCE
+            if (rollout.queen_x - site.x) ** 2 + (rollout.queen_y - site.y) ** 2 < reach * reach:
+                self._build(state, rollout, plan)
+                rollout.target = None
+                if not rollout.done:
+                    rollout.done = rollout.turn + 1
+            else:
+                rollout.queen_x, rollout.queen_y = movement.step(
+                    rollout.queen_x, rollout.queen_y, site.x, site.y, queen.speed, queen.radius,
+                    site.radius + queen.radius,
+                )
+        else:
+            rollout.target = None
+
+        # Economy and enemy towers shooting the queen
+        for i, level in enumerate(rollout.level):
+            if level and rollout.owner[i] == OwnerType.Friendly:
+                rollout.gold += level
+            elif rollout.attack_radius[i] and rollout.owner[i] == OwnerType.Enemy:
+                site = state.site_map[i]
+                d = math.hypot(rollout.queen_x - site.x, rollout.queen_y - site.y)
+                if d <= rollout.attack_radius[i]:
+                    rollout.queen_hp -= 1 + int((rollout.attack_radius[i] - d) / 200)
+
+        # Enemy knights: new waves, chase, hit, age and get shot by our towers
+        for i, barrack_type in enumerate(rollout.barrack_type):
+            if (
+                barrack_type == UnitType.Knight and rollout.owner[i] == OwnerType.Enemy
+                and self.rng.random() < self.wave_rate
+            ):
+                site = state.site_map[i]
+                rollout.knights.extend([site.x, site.y, UnitType.Knight.max_hp] for _ in range(4))
+        if rollout.knights:
+            towers = [
+                (state.site_map[i].x, state.site_map[i].y, radius)
+                for i, radius in enumerate(rollout.attack_radius)
+                if radius and rollout.owner[i] == OwnerType.Friendly
+            ]
+            reach = UnitType.Knight.radius + queen.radius + TOUCH_DISTANCE
+            alive = []
+            for knight in rollout.knights:
+                dx = rollout.queen_x - knight[0]
+                dy = rollout.queen_y - knight[1]
+                d = math.hypot(dx, dy)
+                step = min(UnitType.Knight.speed, d - reach + TOUCH_DISTANCE)
+                if step > 0:
+                    knight[0] += int(dx * step / d)
+                    knight[1] += int(dy * step / d)
+                    d -= step
+                if d < reach:
+                    rollout.queen_hp -= 1
+                knight[2] -= 1
+                for tx, ty, radius in towers:
+                    if (knight[0] - tx) ** 2 + (knight[1] - ty) ** 2 <= radius * radius:
+                        knight[2] -= 3
+                if knight[2] > 0:
+                    alive.append(knight)
+            rollout.knights = alive
+        rollout.turn += 1
+
+    def evaluate(self, rollout: Rollout) -> float:
+        value = self.gold_value * rollout.gold + self.queen_hp_value * rollout.queen_hp
+        value -= self.delay_value * (rollout.done or self.horizon)
+        barracks = {k: 0 for k in self.barrack_values}
+        for i, owner in enumerate(rollout.owner):
+            if owner != OwnerType.Friendly:
+                continue
+            structure = rollout.structure[i]
+            if structure == StructureType.Goldmine:
+                value += self.income_value * rollout.level[i]
+            elif structure == StructureType.Tower:
+                value += self.tower_value
+            elif structure == StructureType.Barracks:
+                first, next_ones = self.barrack_values[rollout.barrack_type[i]]
+                value += next_ones if barracks[rollout.barrack_type[i]] else first
+                barracks[rollout.barrack_type[i]] += 1
+        return value
+
+    def simulate(self, state: "GameState", root: Rollout, scratch: Rollout, plan: Plan) -> float:
+        scratch.copy_from(root)
+        scratch.target = plan if plan.site_id is not None or plan.move_to is not None else None
+        # The candidate decides this turn, the random policy only once it is done
+        if scratch.target is None:
+            scratch.turn += 1
+            scratch.done = 1
+        for _ in range(self.horizon):
+            self._step(state, scratch)
+        return self.evaluate(scratch)
+
+    def plan_queen(self, state: "GameState") -> Iterator[str]:
+        plans = self.candidates(state)
+        # The heuristic answer while we search
+        yield plans[0].command
+
+        if self.movement is None:
+            self.movement = MovementModel(list(state.site_map.values()))
+        root = Rollout.from_state(state)
+        scratch = Rollout(state.num_sites)
+        bonus = [self.commitment if plan.command == self.last_command else 0. for plan in plans]
+        bonus[0] += self.heuristic_bonus
+        totals = [0.] * len(plans)
+        rounds = 0
+        while (rounds + 1) * len(plans) <= self.max_rollouts:
+            seed = state.turns * self.max_rollouts + rounds + 1
+            scores = []
+            for plan in plans:
+                if state.deadline.expired:
+                    break
+                # Same random future for every candidate of a round: only the plan differs
+                self.rng.seed(seed)
+                scores.append(self.simulate(state, root, scratch, plan))
+            if len(scores) < len(plans):
+                # A partial round would only favour the candidates simulated first
+                break
+            rounds += 1
+            totals = [total + score for total, score in zip(totals, scores)]
+            best = max(range(len(plans)), key=lambda i: totals[i] / rounds + bonus[i])
+            self.last_command = plans[best].command
+            yield self.last_command
+        rollouts = rounds * len(plans)
+        debug('%d rollouts over %d candidates', rollouts, len(plans), category='search')
+
+
+PERSONALITY = MonteCarlo
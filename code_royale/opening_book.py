@@ -0,0 +1,169 @@
+"""
+Build the opening book embedded in the bronze bot with self-play.
+
+The book is only worth anything on real maps: the site layouts and queen positions come
+from inputs dumped by the bots in CodinGame games (the `test_*.txt` files by default), the
+maps of the local referee never show up there. On every map, the default Dummy and a few
+variants (the MonteCarlo search, Dummies with mutated `DummyParams`) play the first
+`--turns` turns from each side, then fall back to the default Dummy for the rest of the game
+against the default bot. Each opening is played on `--seeds` draws of the hidden mine gold.
+The queen commands of the best opening for each map and side go to the bot's OPENING_BOOK
+table, keyed by the map fingerprint and the queen starting position.
+
+Usage:
+    python code_royale/opening_book.py --variants 3 --write
+    python code_royale/opening_book.py --maps dumps/*.txt --write
+"""
+import argparse
+import glob
+import multiprocessing
+import os
+import random
+import re
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from referee import MapLayout, Referee, load_bot
+from tuner import BRONZE, HERE, Vector, mutate
+
+
+RECORDINGS = sorted(glob.glob(os.path.join(HERE, '*', 'test_*.txt')))
+SEARCH = os.path.join(HERE, 'bronze', 'search.py')
+
+# (map, player, variant, seed)
+Task = Tuple[int, int, int, int]
+# Dummy parameters (None for the defaults), use the MonteCarlo search
+Variant = Tuple[Optional[Vector], bool]
+# Points, queen HP difference at the end
+Outcome = Tuple[float, int]
+
+
+def play_opening(
+    args: Tuple[str, MapLayout, Task, Variant, int],
+) -> Tuple[Task, Outcome, str, Tuple[int, int], List[str]]:
+    path, layout, task, (vector, search), opening_turns = args
+    _, player, _, seed = task
+    paths = [path, path]
+    if search:
+        paths[player] = f'{path}+{SEARCH}'
+    referee = Referee(tuple(paths), seed, layout=layout)
+    for bot in referee.bots:
+        bot.module.USE_OPENING_BOOK = False
+    bot = referee.bots[player]
+    module = bot.module
+    if vector is not None:
+        module.Dummy.params = module.DummyParams.from_vector(vector)
+
+    commands = []
+    start = []
+    original_turn = bot.turn
+
+    def recording_turn(turns: int, lines: List[str]) -> List[str]:
+        if turns == opening_turns + 1:
+            module.Dummy.params = module.DummyParams()
+            bot.state.personality = module.Dummy()
+        output = original_turn(turns, lines)
+        if turns == 1:
+            # Where the bot sees its queen, as it will look the book up
+            start.extend((bot.state.my_queen.x, bot.state.my_queen.y))
+        if turns <= opening_turns:
+            commands.append(output[0])
+        return output
+
+    bot.turn = recording_turn
+    result = referee.play()
+    if result.winner is None:
+        points = 0.5
+    else:
+        points = 1. if result.winner == player else 0.
+    outcome = (points, result.queen_hp[player] - result.queen_hp[1 - player])
+    return task, outcome, bot.state.fingerprint, tuple(start), commands
+
+
+def run(tasks: List[Tuple[str, MapLayout, Task, Variant, int]], workers: int) -> Iterator[tuple]:
+    if workers == 1:
+        yield from map(play_opening, tasks)
+        return
+    with multiprocessing.Pool(workers) as pool:
+        yield from pool.imap_unordered(play_opening, tasks, chunksize=4)
+
+
+def write_book(path: str, lines: List[str]):
+    with open(path) as f:
+        source = f.read()
+    table = ''.join(f'{line}\n' for line in lines)
+    source, n = re.subn(r'^OPENING_BOOK = """\n.*?^"""$', f'OPENING_BOOK = """\n{table}"""', source, flags=re.M | re.S)
+    if n != 1:
+        raise ValueError(f'no OPENING_BOOK table in {path}')
+    with open(path, 'w') as f:
+        f.write(source)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the opening book of the bronze bot')
+    parser.add_argument('--bot', default=BRONZE)
+    parser.add_argument('--maps', nargs='+', default=RECORDINGS, help='inputs dumped in CodinGame games')
+    parser.add_argument('--seeds', type=int, default=10, help='draws of the mine gold per map')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--turns', type=int, default=15, help='length of the openings')
+    parser.add_argument('--variants', type=int, default=3, help='Dummies with mutated parameters to try')
+    parser.add_argument('--workers', type=int, default=None, help='defaults to the number of cores')
+    parser.add_argument('--write', action='store_true', help='update the table in the bot instead of printing it')
+    args = parser.parse_args()
+
+    module = load_bot(args.bot, '_book')
+    params = module.DummyParams
+    rng = random.Random(args.seed)
+    variants: List[Variant] = [(None, False), (None, True)] + [
+        (mutate(rng, params().to_vector(), params.bounds(), params.steps(), 0.5), False) for _ in range(args.variants)
+    ]
+    layouts = [MapLayout.from_recording(path) for path in args.maps]
+    tasks = [
+        (args.bot, layout, (m, player, i, seed), variant, args.turns)
+        for m, layout in enumerate(layouts)
+        for player in (0, 1)
+        for i, variant in enumerate(variants)
+        for seed in range(args.seed, args.seed + args.seeds)
+    ]
+
+    start = time.perf_counter()
+    # (map, player, variant) -> summed outcome, and the commands and start position of the first seed
+    outcomes: Dict[Tuple[int, int, int], List[float]] = {}
+    openings: Dict[Tuple[int, int, int], Tuple[str, Tuple[int, int], List[str]]] = {}
+    for (m, player, variant, seed), outcome, fingerprint, queen, commands in run(
+        tasks, args.workers or os.cpu_count() or 1,
+    ):
+        total = outcomes.setdefault((m, player, variant), [0., 0.])
+        total[0] += outcome[0]
+        total[1] += outcome[1]
+        if seed == args.seed:
+            openings[(m, player, variant)] = (fingerprint, queen, commands)
+
+    # (map, player) -> best (outcome, -variant), fingerprint, start, commands
+    best: Dict[Tuple[int, int], tuple] = {}
+    for (m, player, variant), outcome in outcomes.items():
+        fingerprint, queen, commands = openings[(m, player, variant)]
+        if len(commands) < args.turns:
+            continue  # the game ended during the opening
+        # Ties go to the default parameters
+        key = (tuple(outcome), -variant)
+        if (m, player) not in best or key > best[(m, player)][0]:
+            best[(m, player)] = (key, fingerprint, queen, commands)
+
+    improved = sum(1 for (_, variant), *_ in best.values() if variant != 0)
+    print(
+        f'{len(tasks)} games in {time.perf_counter() - start:.1f}s,'
+        f' {len(best)} openings, {improved} better than the default one'
+    )
+    lines = [
+        module.OpeningBook.format_entry(fingerprint, x, y, commands)
+        for _, (_, fingerprint, (x, y), commands) in sorted(best.items())
+    ]
+    if args.write:
+        write_book(args.bot, lines)
+    else:
+        print('\n'.join(lines))
+
+
+if __name__ == '__main__':
+    main()
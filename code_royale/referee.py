@@ -0,0 +1,702 @@
+"""
+Headless Code Royale referee.
+
+Runs two bots in-process (no stdin/stdout, no subprocess) on a seeded, mirrored map.
+The bots are loaded from their file and driven through `init_game()` and `play_turn()`,
+which are the two halves of their `play()` loop: `game_input` and `print` are swapped
+in the bot module so the referee feeds the input lines and collects the commands.
+
+Usage:
+    python code_royale/referee.py code_royale/bronze/first_wave.py code_royale/bronze/first_wave.py --games 20
+
+Simplifications compared to the real referee:
+- site gold and max mine size are always visible
+- creeps do not collide with each other (only with sites and the arena borders)
+- semantically invalid commands (training a busy barracks, building on an enemy tower...) are ignored
+"""
+import argparse
+import dataclasses
+import importlib.util
+import math
+import random
+import sys
+import time
+from collections import deque
+from enum import IntEnum
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+
+WIDTH = 1920
+HEIGHT = 1000
+MAX_TURNS = 200
+START_GOLD = 100
+
+QUEEN_RADIUS = 30
+QUEEN_SPEED = 60
+QUEEN_HP = 100
+# Distance between the edges of the queen and a site to consider it touching
+TOUCH_DISTANCE = 5
+
+TOWER_HP_INITIAL = 200
+TOWER_HP_INCREMENT = 100
+TOWER_HP_MAX = 800
+TOWER_HP_DECAY = 4
+TOWER_HP_TO_AREA = 1000
+TOWER_CREEP_DAMAGE = 3
+TOWER_QUEEN_DAMAGE = 1
+TOWER_DAMAGE_DROP_DISTANCE = 200
+
+KNIGHT_DAMAGE = 1
+ARCHER_DAMAGE = 2
+ARCHER_RANGE = 200
+GIANT_DAMAGE = 80
+CREEP_AGING = 1
+
+
+class StructureType(IntEnum):
+    NoStructure = -1
+    Goldmine = 0
+    Tower = 1
+    Barracks = 2
+
+
+class UnitType(IntEnum):
+    Queen = -1
+    Knight = 0
+    Archer = 1
+    Giant = 2
+
+
+@dataclasses.dataclass(frozen=True)
+class CreepSpec:
+    cost: int
+    numbers: int
+    speed: int
+    radius: int
+    hp: int
+    training_time: int
+
+
+CREEPS: Dict[UnitType, CreepSpec] = {
+    UnitType.Knight: CreepSpec(cost=80, numbers=4, speed=100, radius=20, hp=25, training_time=5),
+    UnitType.Archer: CreepSpec(cost=100, numbers=2, speed=75, radius=25, hp=45, training_time=8),
+    UnitType.Giant: CreepSpec(cost=140, numbers=1, speed=50, radius=40, hp=200, training_time=10),
+}
+
+
+class BotError(Exception):
+    pass
+
+
+class InvalidCommand(Exception):
+
+    def __init__(self, player: int, error: Exception):
+        super().__init__(f'player {player}: {error!r}')
+        self.player = player
+
+
+@dataclasses.dataclass
+class Site:
+    site_id: int
+    x: int
+    y: int
+    radius: int
+    gold: int
+    max_mine_size: int
+
+    structure: StructureType = StructureType.NoStructure
+    owner: int = -1
+    # mine: income, tower: hp, barracks: turns before training is done
+    param_1: int = -1
+    # tower: attack radius, barracks: creep type
+    param_2: int = -1
+
+    def clear(self):
+        self.structure = StructureType.NoStructure
+        self.owner = -1
+        self.param_1 = -1
+        self.param_2 = -1
+
+    def tower_radius(self) -> int:
+        return int(math.sqrt((self.param_1 * TOWER_HP_TO_AREA + math.pi * self.radius ** 2) / math.pi))
+
+
+@dataclasses.dataclass
+class Unit:
+    x: int
+    y: int
+    owner: int
+    unit_type: UnitType
+    health: int
+
+    @property
+    def radius(self) -> int:
+        if self.unit_type == UnitType.Queen:
+            return QUEEN_RADIUS
+        return CREEPS[self.unit_type].radius
+
+    @property
+    def speed(self) -> int:
+        if self.unit_type == UnitType.Queen:
+            return QUEEN_SPEED
+        return CREEPS[self.unit_type].speed
+
+
+def distance(a, b) -> float:
+    return math.hypot(a.x - b.x, a.y - b.y)
+
+
+def move_towards(unit: Unit, x: float, y: float, stop_distance: float = 0):
+    dx = x - unit.x
+    dy = y - unit.y
+    d = math.hypot(dx, dy)
+    step = min(unit.speed, d - stop_distance)
+    if step <= 0:
+        return
+    unit.x = int(round(unit.x + dx * step / d))
+    unit.y = int(round(unit.y + dy * step / d))
+
+
+@dataclasses.dataclass
+class MatchResult:
+    seed: int
+    # None when it is a draw
+    winner: Optional[int]
+    turns: int
+    queen_hp: Tuple[int, int]
+    reason: str = ''
+    # Per bot phase: turn durations in ms, when profiling bots that have a PROFILER
+    profiles: Tuple[Optional[Dict[str, List[float]]], ...] = ()
+
+
+class Bot:
+    # Drives a bot module in-process, its `game_input` and `print` are redirected to the referee
+
+    def __init__(self, path: str, player: int, show_stderr: bool = False, profile: bool = False):
+        self.path = path
+        self.player = player
+        self.show_stderr = show_stderr
+        self._lines: Deque[str] = deque()
+        self._output: List[str] = []
+        self.module = load_bot(path, f'_bot_{player}')
+        self.module.game_input = self._game_input
+        self.module.print = self._print
+        if hasattr(self.module, 'game_input_values'):
+            self.module.game_input_values = self._game_input_values
+        if hasattr(self.module, 'RAISE_PLANNER_ERRORS'):
+            # A planner bug should lose the game here, not turn into a silent WAIT
+            self.module.RAISE_PLANNER_ERRORS = True
+        self.state = None
+        self.profiler = getattr(self.module, 'PROFILER', None)
+        if self.profiler is not None:
+            self.profiler.enabled = profile
+
+    def _game_input(self) -> str:
+        try:
+            return self._lines.popleft()
+        except IndexError:
+            raise BotError('read more input than available')
+
+    def _game_input_values(self, num_lines: int, values: List[int], on_read: Optional[Callable[[], None]] = None):
+        lines = [self._game_input() for _ in range(num_lines)]
+        if on_read is not None:
+            on_read()
+        values[:] = (int(v) for line in lines for v in line.split())
+
+    def _print(self, *args, sep=' ', end='\n', file=None, flush=False):
+        if file is None:
+            self._output.append(sep.join(str(a) for a in args))
+        elif self.show_stderr:
+            print(f'[{self.player}]', *args, sep=sep, end=end, file=sys.stderr)
+
+    def feed(self, lines: List[str]):
+        self._lines.clear()
+        self._lines.extend(lines)
+
+    def start(self, lines: List[str]):
+        self.feed(lines)
+        self.state = self.module.init_game()
+
+    def turn(self, turns: int, lines: List[str]) -> List[str]:
+        self.feed(lines)
+        self._output.clear()
+        self.module.play_turn(self.state, turns)
+        if len(self._output) != 2:
+            raise BotError(f'expected 2 output lines got {len(self._output)}')
+        return self._output
+
+
+def load_bot(path: str, name: str):
+    # bot.py+extra.py: extra.py is then run in the namespace of the bot, as if pasted at its end
+    path, *extensions = path.split('+')
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    for extension in extensions:
+        with open(extension) as f:
+            exec(compile(f.read(), extension, 'exec'), module.__dict__)
+    return module
+
+
+@dataclasses.dataclass(frozen=True)
+class MapLayout:
+    # Init input lines (number of sites, then site_id x y radius), queens of player 0 and 1
+    init_lines: Tuple[str, ...]
+    queens: Tuple[Tuple[int, int], Tuple[int, int]]
+
+    @classmethod
+    def from_recording(cls, path: str) -> "MapLayout":
+        # Inputs dumped by a bot: the init lines, then the first turn tells where the queens are
+        with open(path) as f:
+            lines = [line.strip() for line in f if line.strip()]
+        num_sites = int(lines[0])
+        turn = lines[num_sites + 1:]
+        num_units = int(turn[num_sites + 1])
+        queens = {}
+        for line in turn[num_sites + 2:num_sites + 2 + num_units]:
+            x, y, owner, unit_type, _ = (int(v) for v in line.split())
+            if unit_type == UnitType.Queen:
+                queens[owner] = (x, y)
+        return cls(init_lines=tuple(lines[:num_sites + 1]), queens=(queens[0], queens[1]))
+
+
+class Referee:
+
+    def __init__(
+        self,
+        bot_paths: Tuple[str, str],
+        seed: int,
+        show_stderr: bool = False,
+        profile: bool = False,
+        layout: Optional[MapLayout] = None,
+    ):
+        self.seed = seed
+        # Play on a known map (sites and queens) instead of a generated one
+        self.layout = layout
+        self.rng = random.Random(seed)
+        self.bots = [Bot(path, player, show_stderr, profile) for player, path in enumerate(bot_paths)]
+        self.sites: List[Site] = []
+        self.units: List[Unit] = []
+        self.queens: List[Unit] = []
+        self.gold = [START_GOLD, START_GOLD]
+        self.turns = 0
+
+    # Map generation
+
+    def generate_map(self):
+        if self.layout is not None:
+            self.load_map(self.layout)
+            return
+        rng = self.rng
+        n_pairs = rng.randint(9, 12)
+        sites: List[Site] = []
+        attempts = 0
+        while len(sites) < n_pairs * 2 and attempts < 1000:
+            attempts += 1
+            radius = rng.randint(60, 90)
+            x = rng.randint(radius + 30, WIDTH // 2 - 30)
+            y = rng.randint(radius + 30, HEIGHT - radius - 30)
+            mirror_x = WIDTH - x
+            mirror_y = HEIGHT - y
+            # leave enough room for the queen to walk between sites
+            min_gap = 2 * QUEEN_RADIUS
+            if math.hypot(mirror_x - x, mirror_y - y) < 2 * radius + min_gap:
+                continue
+            if any(
+                math.hypot(s.x - px, s.y - py) < s.radius + radius + min_gap
+                for s in sites
+                for px, py in ((x, y), (mirror_x, mirror_y))
+            ):
+                continue
+            gold = rng.randint(10, 30) * 10
+            max_mine_size = rng.randint(1, 3)
+            for px, py in ((x, y), (mirror_x, mirror_y)):
+                sites.append(Site(
+                    site_id=len(sites), x=px, y=py, radius=radius, gold=gold, max_mine_size=max_mine_size,
+                ))
+        self.sites = sites
+
+        corner_y = rng.choice((200, HEIGHT - 200))
+        self.queens = [
+            Unit(x=200, y=corner_y, owner=0, unit_type=UnitType.Queen, health=QUEEN_HP),
+            Unit(x=WIDTH - 200, y=HEIGHT - corner_y, owner=1, unit_type=UnitType.Queen, health=QUEEN_HP),
+        ]
+        for q in self.queens:
+            self._collide(q)
+
+    def load_map(self, layout: "MapLayout"):
+        # Gold and mine sizes are not in the init input, they are drawn like generated ones
+        rng = self.rng
+        self.sites = []
+        for line in layout.init_lines[1:]:
+            site_id, x, y, radius = (int(v) for v in line.split())
+            self.sites.append(Site(
+                site_id=site_id, x=x, y=y, radius=radius,
+                gold=rng.randint(10, 30) * 10, max_mine_size=rng.randint(1, 3),
+            ))
+        self.queens = [
+            Unit(x=x, y=y, owner=player, unit_type=UnitType.Queen, health=QUEEN_HP)
+            for player, (x, y) in enumerate(layout.queens)
+        ]
+
+    # Inputs
+
+    def init_input(self) -> List[str]:
+        lines = [str(len(self.sites))]
+        lines.extend(f'{s.site_id} {s.x} {s.y} {s.radius}' for s in self.sites)
+        return lines
+
+    def turn_input(self, player: int) -> List[str]:
+        def relative(owner: int) -> int:
+            if owner < 0:
+                return -1
+            return 0 if owner == player else 1
+
+        touched = self._touched_site(self.queens[player])
+        lines = [f'{self.gold[player]} {touched.site_id if touched else -1}']
+        lines.extend(
+            f'{s.site_id} {s.gold} {s.max_mine_size} {s.structure.value} {relative(s.owner)} {s.param_1} {s.param_2}'
+            for s in self.sites
+        )
+        all_units = self.queens + self.units
+        lines.append(str(len(all_units)))
+        lines.extend(
+            f'{u.x} {u.y} {relative(u.owner)} {u.unit_type.value} {u.health}'
+            for u in all_units
+        )
+        return lines
+
+    # Rules
+
+    def _touched_site(self, queen: Unit) -> Optional[Site]:
+        touched = None
+        touched_d = None
+        for s in self.sites:
+            d = distance(queen, s) - queen.radius - s.radius
+            if d < TOUCH_DISTANCE and (touched is None or d < touched_d):
+                touched, touched_d = s, d
+        return touched
+
+    def _collide(self, unit: Unit):
+        for s in self.sites:
+            min_d = s.radius + unit.radius
+            dx = unit.x - s.x
+            dy = unit.y - s.y
+            d = math.hypot(dx, dy)
+            if d >= min_d:
+                continue
+            if d == 0:
+                dx, dy, d = 1, 0, 1
+            unit.x = int(math.ceil(s.x + dx * min_d / d)) if dx > 0 else int(math.floor(s.x + dx * min_d / d))
+            unit.y = int(math.ceil(s.y + dy * min_d / d)) if dy > 0 else int(math.floor(s.y + dy * min_d / d))
+        unit.x = min(max(unit.x, unit.radius), WIDTH - unit.radius)
+        unit.y = min(max(unit.y, unit.radius), HEIGHT - unit.radius)
+
+    def _build(self, player: int, site: Site, what: str):
+        if site.owner not in (-1, player) and site.structure == StructureType.Tower:
+            return  # cannot build on an enemy tower
+
+        if what == 'MINE':
+            if site.gold <= 0:
+                return
+            if site.owner == player and site.structure == StructureType.Goldmine:
+                site.param_1 = min(site.param_1 + 1, site.max_mine_size)
+                return
+            site.clear()
+            site.structure = StructureType.Goldmine
+            site.param_1 = 1
+        elif what == 'TOWER':
+            if site.owner == player and site.structure == StructureType.Tower:
+                site.param_1 = min(site.param_1 + TOWER_HP_INCREMENT, TOWER_HP_MAX)
+            else:
+                site.clear()
+                site.structure = StructureType.Tower
+                site.param_1 = TOWER_HP_INITIAL
+            site.param_2 = site.tower_radius()
+        elif what.startswith('BARRACKS-'):
+            try:
+                creep_type = UnitType[what[len('BARRACKS-'):].capitalize()]
+            except KeyError:
+                raise BotError(f'unknown barracks {what}')
+            if creep_type == UnitType.Queen:
+                raise BotError(f'unknown barracks {what}')
+            if (
+                site.owner == player and site.structure == StructureType.Barracks
+                and site.param_2 == creep_type
+            ):
+                return
+            site.clear()
+            site.structure = StructureType.Barracks
+            site.param_1 = 0
+            site.param_2 = creep_type.value
+        else:
+            raise BotError(f'unknown structure {what}')
+        site.owner = player
+
+    def _queen_actions(self, commands: List[str]):
+        builds: Dict[int, List[Tuple[int, str]]] = {}
+        for player, command in enumerate(commands):
+            queen = self.queens[player]
+            tokens = command.split()
+            if not tokens:
+                raise BotError('empty queen command')
+            if tokens[0] == 'WAIT':
+                continue
+            elif tokens[0] == 'MOVE' and len(tokens) == 3:
+                move_towards(queen, int(tokens[1]), int(tokens[2]))
+                self._collide(queen)
+            elif tokens[0] == 'BUILD' and len(tokens) == 3:
+                site_id = int(tokens[1])
+                if not 0 <= site_id < len(self.sites):
+                    raise BotError(f'unknown site {site_id}')
+                site = self.sites[site_id]
+                if self._touched_site(queen) is site:
+                    builds.setdefault(site_id, []).append((player, tokens[2]))
+                else:
+                    move_towards(queen, site.x, site.y, queen.radius + site.radius)
+                    self._collide(queen)
+            else:
+                raise BotError(f'invalid queen command {command!r}')
+
+        for site_id, orders in builds.items():
+            if len(orders) > 1:
+                continue  # both queens fight for the site: nobody builds
+            player, what = orders[0]
+            try:
+                self._build(player, self.sites[site_id], what)
+            except BotError as e:
+                raise InvalidCommand(player, e)
+
+    def _train(self, player: int, command: str):
+        tokens = command.split()
+        if not tokens or tokens[0] != 'TRAIN':
+            raise BotError(f'invalid train command {command!r}')
+        for token in tokens[1:]:
+            site_id = int(token)
+            if not 0 <= site_id < len(self.sites):
+                raise BotError(f'unknown site {site_id}')
+            site = self.sites[site_id]
+            if site.owner != player or site.structure != StructureType.Barracks or site.param_1 != 0:
+                continue
+            spec = CREEPS[UnitType(site.param_2)]
+            if self.gold[player] < spec.cost:
+                continue
+            self.gold[player] -= spec.cost
+            site.param_1 = spec.training_time
+
+    def _closest(self, unit: Unit, candidates) -> Tuple[Optional[object], float]:
+        best = None
+        best_d = 0.
+        for c in candidates:
+            d = distance(unit, c)
+            if best is None or d < best_d:
+                best, best_d = c, d
+        return best, best_d
+
+    def _move_creeps(self):
+        for u in self.units:
+            enemy = 1 - u.owner
+            if u.unit_type == UnitType.Knight:
+                queen = self.queens[enemy]
+                move_towards(u, queen.x, queen.y, u.radius + queen.radius)
+            elif u.unit_type == UnitType.Giant:
+                tower, _ = self._closest(u, (
+                    s for s in self.sites if s.owner == enemy and s.structure == StructureType.Tower
+                ))
+                if tower is not None:
+                    move_towards(u, tower.x, tower.y, u.radius + tower.radius)
+            else:
+                target, _ = self._closest(u, (c for c in self.units if c.owner == enemy))
+                if target is None:
+                    target = self.queens[u.owner]
+                    move_towards(u, target.x, target.y, u.radius + target.radius)
+                else:
+                    move_towards(u, target.x, target.y, ARCHER_RANGE)
+            self._collide(u)
+
+    def _creep_attacks(self):
+        for u in self.units:
+            enemy = 1 - u.owner
+            if u.unit_type == UnitType.Knight:
+                queen = self.queens[enemy]
+                if distance(u, queen) - u.radius - queen.radius < TOUCH_DISTANCE:
+                    queen.health -= KNIGHT_DAMAGE
+            elif u.unit_type == UnitType.Giant:
+                for s in self.sites:
+                    if (
+                        s.owner == enemy and s.structure == StructureType.Tower
+                        and distance(u, s) - u.radius - s.radius < TOUCH_DISTANCE
+                    ):
+                        s.param_1 -= GIANT_DAMAGE
+                        break
+            else:
+                target, d = self._closest(u, (c for c in self.units if c.owner == enemy))
+                if target is not None and d <= ARCHER_RANGE:
+                    target.health -= ARCHER_DAMAGE
+
+    def _tower_attacks(self):
+        for s in self.sites:
+            if s.structure != StructureType.Tower:
+                continue
+            enemy = 1 - s.owner
+            target, d = self._closest(s, (c for c in self.units if c.owner == enemy))
+            if target is not None and d <= s.param_2:
+                target.health -= TOWER_CREEP_DAMAGE + int((s.param_2 - d) / TOWER_DAMAGE_DROP_DISTANCE)
+                continue
+            queen = self.queens[enemy]
+            d = distance(s, queen)
+            if d <= s.param_2:
+                queen.health -= TOWER_QUEEN_DAMAGE + int((s.param_2 - d) / TOWER_DAMAGE_DROP_DISTANCE)
+
+    def _update_structures(self):
+        for s in self.sites:
+            if s.structure == StructureType.Goldmine:
+                income = min(s.param_1, s.gold)
+                self.gold[s.owner] += income
+                s.gold -= income
+                if s.gold <= 0:
+                    s.clear()
+            elif s.structure == StructureType.Tower:
+                s.param_1 -= TOWER_HP_DECAY
+                if s.param_1 <= 0:
+                    s.clear()
+                else:
+                    s.param_2 = s.tower_radius()
+            elif s.structure == StructureType.Barracks and s.param_1 > 0:
+                s.param_1 -= 1
+                if s.param_1 == 0:
+                    creep_type = UnitType(s.param_2)
+                    for i in range(CREEPS[creep_type].numbers):
+                        creep = Unit(
+                            x=s.x, y=s.y + i, owner=s.owner, unit_type=creep_type, health=CREEPS[creep_type].hp,
+                        )
+                        self._collide(creep)
+                        self.units.append(creep)
+
+    def _check_queen_command(self, player: int, command: str):
+        tokens = command.split()
+        try:
+            if tokens == ['WAIT']:
+                return
+            elif len(tokens) == 3 and tokens[0] == 'MOVE':
+                int(tokens[1]), int(tokens[2])
+            elif len(tokens) == 3 and tokens[0] == 'BUILD':
+                if not 0 <= int(tokens[1]) < len(self.sites):
+                    raise BotError(f'unknown site {tokens[1]}')
+            else:
+                raise BotError(f'invalid queen command {command!r}')
+        except (BotError, ValueError) as e:
+            raise InvalidCommand(player, e)
+
+    def step(self, commands: List[List[str]]):
+        for player in (0, 1):
+            self._check_queen_command(player, commands[player][0])
+        for player in (0, 1):
+            try:
+                self._train(player, commands[player][1])
+            except (BotError, ValueError) as e:
+                raise InvalidCommand(player, e)
+        self._queen_actions([c[0] for c in commands])
+        self._move_creeps()
+        self._creep_attacks()
+        self._tower_attacks()
+        for u in self.units:
+            u.health -= CREEP_AGING
+        self.units = [u for u in self.units if u.health > 0]
+        self._update_structures()
+
+    def _result(self, winner: Optional[int], reason: str) -> MatchResult:
+        return MatchResult(
+            seed=self.seed,
+            winner=winner,
+            turns=self.turns,
+            queen_hp=(self.queens[0].health, self.queens[1].health),
+            reason=reason,
+            profiles=tuple(
+                bot.profiler.samples if bot.profiler is not None and bot.profiler.enabled else None
+                for bot in self.bots
+            ),
+        )
+
+    def play(self) -> MatchResult:
+        self.generate_map()
+        init_lines = self.init_input()
+        for bot in self.bots:
+            try:
+                bot.start(init_lines)
+            except Exception as e:
+                return self._result(1 - bot.player, f'player {bot.player} crashed at init: {e!r}')
+
+        while self.turns < MAX_TURNS:
+            self.turns += 1
+            commands = []
+            for bot in self.bots:
+                try:
+                    commands.append(bot.turn(self.turns, self.turn_input(bot.player)))
+                except Exception as e:
+                    return self._result(1 - bot.player, f'player {bot.player} crashed: {e!r}')
+            try:
+                self.step(commands)
+            except InvalidCommand as e:
+                return self._result(1 - e.player, f'invalid command from {e}')
+
+            dead = [q.health <= 0 for q in self.queens]
+            if all(dead):
+                return self._result(None, 'both queens died')
+            elif dead[0]:
+                return self._result(1, 'queen 0 died')
+            elif dead[1]:
+                return self._result(0, 'queen 1 died')
+
+        hp = [q.health for q in self.queens]
+        if hp[0] == hp[1]:
+            return self._result(None, 'timeout')
+        return self._result(0 if hp[0] > hp[1] else 1, 'timeout')
+
+
+def play_match(bot_paths: Tuple[str, str], seed: int, show_stderr: bool = False, profile: bool = False) -> MatchResult:
+    return Referee(bot_paths, seed, show_stderr=show_stderr, profile=profile).play()
+
+
+def merge_profiles(merged: Dict[str, Dict[str, List[float]]], bot_paths: Tuple[str, ...], result: MatchResult):
+    for path, profile in zip(bot_paths, result.profiles):
+        if profile:
+            for phase, samples in profile.items():
+                merged.setdefault(path, {}).setdefault(phase, []).extend(samples)
+
+
+def print_profiles(merged: Dict[str, Dict[str, List[float]]]):
+    for path, samples in merged.items():
+        print(f'Turn phases of {path}:')
+        print(load_bot(path, '_profile').Profiler.histogram(samples))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run Code Royale games locally')
+    parser.add_argument('bot_0')
+    parser.add_argument('bot_1')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--games', type=int, default=1)
+    parser.add_argument('--stderr', action='store_true', help='show the bots debug output')
+    parser.add_argument('--profile', action='store_true', help='time the phases of the bots turns')
+    args = parser.parse_args()
+
+    wins = [0, 0]
+    draws = 0
+    profiles = {}
+    start = time.perf_counter()
+    for seed in range(args.seed, args.seed + args.games):
+        result = play_match((args.bot_0, args.bot_1), seed, show_stderr=args.stderr, profile=args.profile)
+        merge_profiles(profiles, (args.bot_0, args.bot_1), result)
+        print(dataclasses.replace(result, profiles=()))
+        if result.winner is None:
+            draws += 1
+        else:
+            wins[result.winner] += 1
+    elapsed = time.perf_counter() - start
+    print(f'{wins[0]} - {wins[1]} ({draws} draws) in {elapsed:.2f}s: {args.games / elapsed * 60:.0f} games/min')
+    print_profiles(profiles)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+import itertools
+import os
+import random
+
+from referee import Referee, load_bot
+
+
+BRONZE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bronze', 'first_wave.py')
+BOT = load_bot(BRONZE, '_test_first_wave')
+SEARCH = load_bot(BRONZE + '+' + os.path.join(os.path.dirname(BRONZE), 'search.py'), '_test_search')
+
+
+def test_bot_fits_in_the_codingame_editor():
+    # CodinGame rejects submissions of 100k characters or more
+    with open(BRONZE) as f:
+        source = f.read()
+    assert len(source) < 100_000, len(source)
+
+
+def brute_force_training(gold, available, values):
+    # Best (value, gold spent) over every affordable count of each creep type
+    best = (0, 0)
+    types = BOT.TrainingKnapsack.types
+    for counts in itertools.product(*(range(min(a, BOT.TrainingKnapsack.max_barracks) + 1) for a in available)):
+        if any(n and v <= 0 for n, v in zip(counts, values)):
+            continue
+        cost = sum(n * t.cost for n, t in zip(counts, types))
+        if cost <= gold:
+            best = max(best, (sum(n * v for n, v in zip(counts, values)), cost))
+    return best
+
+
+def test_training_knapsack_is_exact():
+    knapsack = BOT.TRAINING_KNAPSACK
+    rng = random.Random(0)
+    budgets = [-200, -90, -1, 0, 40, 79, 80] + [rng.randrange(-200, 2500) for _ in range(2000)]
+    for gold in budgets:
+        available = tuple(rng.randrange(0, 9) for _ in knapsack.types)
+        values = tuple(rng.choice((0., 0.5, 0.8, 1., 2., 3.7)) for _ in knapsack.types)
+        counts = knapsack.solve(gold, available, values)
+        assert all(0 <= n <= a for n, a in zip(counts, available))
+        spent = sum(n * t.cost for n, t in zip(counts, knapsack.types))
+        assert spent <= max(gold, 0)
+        value = sum(n * v for n, v in zip(counts, values))
+        best_value, best_spent = brute_force_training(gold, available, values)
+        assert abs(value - best_value) < 1e-9 and spent == best_spent, (gold, available, values, counts)
+
+
+def test_training_knapsack_saves_when_broke():
+    assert BOT.TRAINING_KNAPSACK.solve(-90, (3, 2, 0), (0.8, 0.5, 0.)) == (0, 0, 0)
+    assert BOT.TRAINING_KNAPSACK.solve(40, (3, 2, 0), (0.8, 0.5, 0.)) == (0, 0, 0)
+
+
+def test_log_sink_counts_every_dropped_line(capsys):
+    sink = BOT.LogSink(max_bytes=100)
+    for i in range(200):
+        sink.write(BOT.LogLevel.Debug, f'D line {i:03d}')
+    sink.flush()
+    lines = capsys.readouterr().err.splitlines()
+    assert lines[-1] == f'... {200 - (len(lines) - 1)} log lines dropped'
+
+
+def test_unknown_log_level_is_ignored(capsys):
+    levels = dict(BOT.LOG_LEVELS)
+    try:
+        BOT._load_log_levels('build=verbose,evade=debug')
+        assert 'build' not in BOT.LOG_LEVELS
+        assert BOT.LOG_LEVELS['evade'] == BOT.LogLevel.Debug
+    finally:
+        BOT.LOG_LEVELS.clear()
+        BOT.LOG_LEVELS.update(levels)
+    assert 'build=verbose' in capsys.readouterr().err
+
+
+def failing_planner():
+    yield 'MOVE 1 1'
+    raise ValueError('planner bug')
+
+
+def test_run_anytime_reports_planner_failures(capsys):
+    deadline = BOT.Deadline(1000.)
+    flag = BOT.RAISE_PLANNER_ERRORS
+    try:
+        BOT.RAISE_PLANNER_ERRORS = False
+        assert BOT.run_anytime(deadline, 'WAIT', failing_planner()) == 'MOVE 1 1'
+        BOT.LOG_SINK.flush()
+        err = capsys.readouterr().err
+        assert 'Planner failed, playing MOVE 1 1' in err and 'ValueError: planner bug' in err
+
+        BOT.RAISE_PLANNER_ERRORS = True
+        try:
+            BOT.run_anytime(deadline, 'WAIT', failing_planner())
+        except ValueError:
+            pass
+        else:
+            raise AssertionError('the planner failure was swallowed')
+    finally:
+        BOT.RAISE_PLANNER_ERRORS = flag
+
+
+def test_threat_map_follows_the_site_events():
+    # The incremental threat map, fed by the site events, matches one built from scratch every turn
+    referee = Referee((BRONZE, BRONZE), 3)
+    bot = referee.bots[0]
+    original_turn = bot.turn
+    checked = []
+
+    def checking_turn(turns, lines):
+        output = original_turn(turns, lines)
+        state = bot.state
+        expected = BOT.ThreatMap()
+        for site in state.site_map.values():
+            expected.set_tower(site)
+        assert state.threat_map.damage == expected.damage
+        checked.append(any(state.threat_map.damage))
+        return output
+
+    bot.turn = checking_turn
+    referee.play()
+    assert any(checked)
+
+
+def test_movement_model_steps_like_the_referee():
+    # The queen moves the MovementModel predicts, over whole games
+    checked = 0
+    for seed in range(5):
+        referee = Referee((BRONZE, BRONZE), seed)
+        for bot in referee.bots:
+            original_turn = bot.turn
+            expected = []
+
+            def checking_turn(turns, lines, bot=bot, original_turn=original_turn, expected=expected):
+                nonlocal checked
+                output = original_turn(turns, lines)
+                state = bot.state
+                queen = state.my_queen
+                if expected:
+                    assert (queen.x, queen.y) == expected.pop(), (seed, turns)
+                    checked += 1
+                model = SEARCH.MovementModel(list(state.site_map.values()))
+                tokens = output[0].split()
+                speed, radius = BOT.UnitType.Queen.speed, BOT.UnitType.Queen.radius
+                if tokens[0] == 'MOVE':
+                    expected.append(model.step(queen.x, queen.y, int(tokens[1]), int(tokens[2]), speed, radius))
+                elif tokens[0] == 'BUILD' and state.touched_site_id != int(tokens[1]):
+                    site = state.site_map[int(tokens[1])]
+                    expected.append(model.step(queen.x, queen.y, site.x, site.y, speed, radius, site.radius + radius))
+                return output
+
+            bot.turn = checking_turn
+        referee.play()
+    assert checked > 100
+
+
+def test_economy_counts_mines_running_dry():
+    economy = BOT.Economy()
+    # 7 gold at 3 a turn: two full turns, what is left, then nothing
+    assert economy.profile(7, 3, 5) == (3, 3, 1, 0, 0)
+    # Upgraded from 1 to 3 after 2 turns
+    assert economy.profile(20, 1, 5, delay=2, upgraded=3) == (1, 1, 3, 3, 3)
+    assert economy.profile(8, 1, 5, delay=2, upgraded=3) == (1, 1, 3, 3, 0)
+
+    def mine(gold, income):
+        return BOT.BuildingSite(
+            x=0, y=0, site_id=0, radius=60, structure=BOT.StructureType.Goldmine, owner=BOT.OwnerType.Friendly,
+            gold=gold, max_mine_size=3, param_1=income,
+        )
+
+    # Income 2, upgraded to 3 in 2 turns: 3 more gold over 5 turns, unless the mine runs dry first
+    assert economy.mine_gain(mine(30, 2), 5, delay=2) == 3
+    assert economy.mine_gain(mine(10, 2), 5, delay=2) == 0
+    assert economy.mine_gain(mine(11, 2), 5, delay=2) == 1
+    # A new mine on a free site with 3 gold left, built in 1 turn
+    free = BOT.BuildingSite(x=0, y=0, site_id=1, radius=60, gold=3)
+    assert economy.mine_gain(free, 5, delay=1) == 3
+    assert economy.mine_gain(free, 5, delay=4) == 1
+    assert economy.mine_gain(free, 5, delay=5) == 0
+    assert economy.mined(mine(7, 3), 5) == 7
+    assert not economy.lasts(mine(7, 3), 5) and economy.lasts(mine(15, 3), 5)
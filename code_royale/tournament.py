@@ -0,0 +1,184 @@
+"""
+Self-play tournament between bot versions.
+
+Every pair of bots plays `--games` seeded games, swapping sides every other game so that
+each map is played from both corners. Games are spread over a process pool and results
+are streamed back as they finish.
+
+Usage:
+    python code_royale/tournament.py code_royale/wood_3_league/first_wave.py code_royale/bronze/first_wave.py --games 1000
+"""
+import argparse
+import dataclasses
+import itertools
+import math
+import multiprocessing
+import os
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from referee import MatchResult, merge_profiles, play_match, print_profiles
+
+
+# 95% confidence
+Z_SCORE = 1.96
+
+
+@dataclasses.dataclass(frozen=True)
+class Match:
+    # Index of the bots in the tournament, in the order they play (player 0, player 1)
+    bots: Tuple[int, int]
+    seed: int
+
+
+@dataclasses.dataclass
+class Score:
+    wins: int = 0
+    losses: int = 0
+    draws: int = 0
+
+    @property
+    def games(self) -> int:
+        return self.wins + self.losses + self.draws
+
+    @property
+    def score(self) -> float:
+        if not self.games:
+            return 0.5
+        return (self.wins + 0.5 * self.draws) / self.games
+
+    def interval(self) -> Tuple[float, float]:
+        # Wilson score interval, draws count as half a win
+        n = self.games
+        if not n:
+            return 0., 1.
+        p = self.score
+        denominator = 1 + Z_SCORE ** 2 / n
+        centre = (p + Z_SCORE ** 2 / (2 * n)) / denominator
+        margin = Z_SCORE * math.sqrt(p * (1 - p) / n + Z_SCORE ** 2 / (4 * n ** 2)) / denominator
+        return max(centre - margin, 0.), min(centre + margin, 1.)
+
+
+def elo_difference(score: float) -> float:
+    score = min(max(score, 1e-4), 1 - 1e-4)
+    return -400 * math.log10(1 / score - 1)
+
+
+def fit_elo(n_bots: int, scores: Dict[Tuple[int, int], Score], iterations: int = 200) -> List[float]:
+    # Bradley-Terry fit (minorization-maximization), anchored on the first bot at 0
+    strength = [1.] * n_bots
+    for _ in range(iterations):
+        updated = []
+        for i in range(n_bots):
+            won = 0.
+            denominator = 0.
+            for j in range(n_bots):
+                if i == j:
+                    continue
+                score = scores.get((i, j))
+                if score is None or not score.games:
+                    continue
+                # half a win for each side on draws, and a prior of one draw to avoid 0 or infinite ratings
+                won += score.wins + 0.5 * score.draws + 0.5
+                denominator += (score.games + 1) / (strength[i] + strength[j])
+            updated.append(won / denominator if denominator else strength[i])
+        strength = updated
+    return [400 * math.log10(s / strength[0]) for s in strength]
+
+
+def run_match(args: Tuple[Tuple[str, ...], Match, bool]) -> Tuple[Match, MatchResult]:
+    paths, match, profile = args
+    return match, play_match((paths[match.bots[0]], paths[match.bots[1]]), match.seed, profile=profile)
+
+
+def schedule(n_bots: int, games: int, seed: int) -> Iterator[Match]:
+    for a, b in itertools.combinations(range(n_bots), 2):
+        for g in range(games):
+            # Same map twice in a row with swapped sides
+            bots = (a, b) if g % 2 == 0 else (b, a)
+            yield Match(bots=bots, seed=seed + g // 2)
+
+
+def run_tournament(
+    paths: List[str],
+    games: int,
+    seed: int = 0,
+    workers: Optional[int] = None,
+    profile: bool = False,
+) -> Iterator[Tuple[Match, MatchResult]]:
+    tasks = [(tuple(paths), m, profile) for m in schedule(len(paths), games, seed)]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for task in tasks:
+            yield run_match(task)
+        return
+
+    # Small chunks keep the workers busy until the very end, games are ~100ms each
+    chunksize = max(1, min(16, len(tasks) // (workers * 8)))
+    with multiprocessing.Pool(workers) as pool:
+        yield from pool.imap_unordered(run_match, tasks, chunksize=chunksize)
+
+
+def record(scores: Dict[Tuple[int, int], Score], match: Match, result: MatchResult):
+    a, b = match.bots
+    for me, them, player in ((a, b, 0), (b, a, 1)):
+        score = scores.setdefault((me, them), Score())
+        if result.winner is None:
+            score.draws += 1
+        elif result.winner == player:
+            score.wins += 1
+        else:
+            score.losses += 1
+
+
+def report(paths: List[str], scores: Dict[Tuple[int, int], Score]):
+    names = [f'{i}:{os.path.relpath(p)}' for i, p in enumerate(paths)]
+    for (a, b), score in sorted(scores.items()):
+        if a > b:
+            continue
+        low, high = score.interval()
+        print(
+            f'{names[a]} vs {names[b]}: +{score.wins} -{score.losses} ={score.draws}'
+            f' score={score.score:.3f} [{low:.3f}, {high:.3f}]'
+            f' elo={elo_difference(score.score):+.0f} [{elo_difference(low):+.0f}, {elo_difference(high):+.0f}]'
+        )
+    if len(paths) > 2:
+        for name, elo in sorted(zip(names, fit_elo(len(paths), scores)), key=lambda e: -e[1]):
+            print(f'{elo:+6.0f} {name}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a self-play tournament between bots')
+    parser.add_argument('bots', nargs='+')
+    parser.add_argument('--games', type=int, default=100, help='games per pair of bots')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None, help='defaults to the number of cores')
+    parser.add_argument('--progress', type=int, default=100, help='print the standings every N games')
+    parser.add_argument('--profile', action='store_true', help='time the phases of the bots turns')
+    args = parser.parse_args()
+
+    if len(args.bots) < 2:
+        parser.error('need at least 2 bots')
+
+    scores: Dict[Tuple[int, int], Score] = {}
+    profiles = {}
+    start = time.perf_counter()
+    results = run_tournament(args.bots, args.games, args.seed, args.workers, args.profile)
+    for played, (match, result) in enumerate(results, 1):
+        record(scores, match, result)
+        merge_profiles(profiles, tuple(args.bots[b] for b in match.bots), result)
+        if result.reason.startswith(('invalid', 'player')):
+            print(f'{match}: {result.reason}')
+        if args.progress and played % args.progress == 0:
+            elapsed = time.perf_counter() - start
+            print(f'--- {played} games in {elapsed:.1f}s ({played / elapsed:.1f} games/s)')
+            report(args.bots, scores)
+
+    elapsed = time.perf_counter() - start
+    print(f'=== {sum(s.games for s in scores.values()) // 2} games in {elapsed:.1f}s')
+    report(args.bots, scores)
+    print_profiles(profiles)
+
+
+if __name__ == '__main__':
+    main()
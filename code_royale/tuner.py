@@ -0,0 +1,206 @@
+"""
+Tune the Dummy's thresholds (`DummyParams`) with a genetic algorithm.
+
+Every candidate parameter vector plays the same seeded games against the bot with its
+default parameters, swapping sides every other game. The games of a whole generation
+are spread over a process pool, and results are cached by (parameters, game) so that
+configurations seen before are never replayed. `--cache` keeps them between runs, as long
+as the bot source and its `DummyParams` fields did not change.
+
+Usage:
+    python code_royale/tuner.py --generations 20 --population 16 --games 40 --cache /tmp/tuner.json
+"""
+import argparse
+import dataclasses
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from referee import Referee, load_bot
+from tournament import Match, Score, elo_difference
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BRONZE = os.path.join(HERE, 'bronze', 'first_wave.py')
+
+Vector = Tuple[float, ...]
+# (parameters, bots order, seed) -> winning player or None
+Game = Tuple[Vector, Match]
+
+
+def play_game(args: Tuple[str, Game]) -> Tuple[Game, Optional[int]]:
+    # The tuned bot is bots[0] of the match, the default one bots[1]
+    path, game = args
+    vector, match = game
+    referee = Referee((path, path), match.seed)
+    tuned = referee.bots[match.bots.index(0)].module
+    tuned.Dummy.params = tuned.DummyParams.from_vector(vector)
+    return game, referee.play().winner
+
+
+def bot_version(path: str) -> str:
+    # Cached results are only valid for the same bot source and parameter layout
+    source = b''
+    for part in path.split('+'):
+        with open(part, 'rb') as f:
+            source += f.read()
+    fields = ','.join(f.name for f in dataclasses.fields(load_bot(path, '_version').DummyParams))
+    return hashlib.sha1(source + fields.encode()).hexdigest()
+
+
+def schedule(games: int, seed: int) -> List[Match]:
+    # Same maps for everyone, each played from both corners
+    return [Match(bots=(0, 1) if g % 2 == 0 else (1, 0), seed=seed + g // 2) for g in range(games)]
+
+
+class Evaluator:
+
+    def __init__(self, path: str, matches: List[Match], workers: int, cache_path: Optional[str] = None):
+        self.path = path
+        self.matches = matches
+        self.workers = workers
+        self.cache_path = cache_path
+        self.version = bot_version(path)
+        self.results: Dict[Game, Optional[int]] = {}
+        self.played = 0
+        if cache_path and os.path.exists(cache_path):
+            with open(cache_path) as f:
+                cache = json.load(f)
+            if not isinstance(cache, dict) or cache.get('version') != self.version:
+                print(f'{cache_path} is for another version of the bot, not using it')
+                return
+            for vector, bots, seed, winner in cache['results']:
+                self.results[(tuple(vector), Match(bots=tuple(bots), seed=seed))] = winner
+
+    def save(self):
+        if self.cache_path:
+            with open(self.cache_path, 'w') as f:
+                json.dump({
+                    'version': self.version,
+                    'results': [
+                        (vector, match.bots, match.seed, winner)
+                        for (vector, match), winner in self.results.items()
+                    ],
+                }, f)
+
+    def _play(self, games: List[Game]) -> Iterator[Tuple[Game, Optional[int]]]:
+        tasks = [(self.path, g) for g in games]
+        if self.workers == 1:
+            yield from map(play_game, tasks)
+            return
+        chunksize = max(1, min(16, len(tasks) // (self.workers * 8)))
+        with multiprocessing.Pool(self.workers) as pool:
+            yield from pool.imap_unordered(play_game, tasks, chunksize=chunksize)
+
+    def evaluate(self, vectors: List[Vector]) -> List[Score]:
+        # One batch for the whole generation, skipping cached games
+        missing = list(dict.fromkeys(
+            (v, m) for v in vectors for m in self.matches if (v, m) not in self.results
+        ))
+        for game, winner in self._play(missing):
+            self.results[game] = winner
+            self.played += 1
+        self.save()
+
+        scores = []
+        for vector in vectors:
+            score = Score()
+            for match in self.matches:
+                winner = self.results[(vector, match)]
+                if winner is None:
+                    score.draws += 1
+                elif match.bots[winner] == 0:
+                    score.wins += 1
+                else:
+                    score.losses += 1
+            scores.append(score)
+        return scores
+
+
+def mutate(
+    rng: random.Random, vector: Vector, bounds: List[Tuple[float, float]], steps: List[float], rate: float,
+) -> Vector:
+    mutated = list(vector)
+    for i, ((low, high), step) in enumerate(zip(bounds, steps)):
+        if rng.random() < rate:
+            mutated[i] = min(max(mutated[i] + rng.choice((-step, step)), low), high)
+    return tuple(mutated)
+
+
+def crossover(rng: random.Random, a: Vector, b: Vector) -> Vector:
+    return tuple(x if rng.random() < 0.5 else y for x, y in zip(a, b))
+
+
+def select(rng: random.Random, ranked: List[Tuple[Score, Vector]], size: int = 3) -> Vector:
+    # Tournament selection, ranked is best first
+    return ranked[min(rng.randrange(len(ranked)) for _ in range(size))][1]
+
+
+def tune(
+    evaluator: Evaluator,
+    default: Vector,
+    bounds: List[Tuple[float, float]],
+    steps: List[float],
+    generations: int,
+    population: int,
+    elite: int,
+    mutation_rate: float,
+    seed: int,
+) -> Iterator[Tuple[int, List[Tuple[Score, Vector]]]]:
+    rng = random.Random(seed)
+    vectors = [default] + [mutate(rng, default, bounds, steps, 0.5) for _ in range(population - 1)]
+    for generation in range(generations):
+        scores = evaluator.evaluate(vectors)
+        ranked = sorted(zip(scores, vectors), key=lambda sv: -sv[0].score)
+        yield generation, ranked
+
+        children = [v for _, v in ranked[:elite]]
+        while len(children) < population:
+            child = crossover(rng, select(rng, ranked), select(rng, ranked))
+            children.append(mutate(rng, child, bounds, steps, mutation_rate))
+        vectors = children
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tune the Dummy's parameters with self-play")
+    parser.add_argument('--bot', default=BRONZE)
+    parser.add_argument('--generations', type=int, default=10)
+    parser.add_argument('--population', type=int, default=16)
+    parser.add_argument('--elite', type=int, default=4, help='best candidates kept as is')
+    parser.add_argument('--mutation-rate', type=float, default=0.2, help='chance to change each parameter')
+    parser.add_argument('--games', type=int, default=40, help='games per candidate against the default parameters')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None, help='defaults to the number of cores')
+    parser.add_argument('--cache', default=None, help='json file keeping the results between runs')
+    args = parser.parse_args()
+
+    params = load_bot(args.bot, '_params').DummyParams
+    evaluator = Evaluator(
+        args.bot, schedule(args.games, args.seed), args.workers or os.cpu_count() or 1, args.cache,
+    )
+
+    start = time.perf_counter()
+    best = None
+    for generation, ranked in tune(
+        evaluator, params().to_vector(), params.bounds(), params.steps(),
+        args.generations, args.population, args.elite, args.mutation_rate, args.seed,
+    ):
+        best = ranked[0]
+        score, vector = best
+        low, high = score.interval()
+        print(
+            f'generation {generation}: {evaluator.played} games played in {time.perf_counter() - start:.1f}s,'
+            f' best score={score.score:.3f} [{low:.3f}, {high:.3f}] elo={elo_difference(score.score):+.0f}'
+            f' {vector}'
+        )
+
+    if best is not None:
+        print(params.from_vector(best[1]))
+
+
+if __name__ == '__main__':
+    main()
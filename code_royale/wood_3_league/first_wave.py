@@ -8,6 +8,9 @@ from typing import List, Dict, Optional, Tuple
 
 class BuildingsType(IntEnum):
     NoStructure = -1
+    # Not built by this league but sent by later league referees
+    Goldmine = 0
+    Tower = 1
     Barracks = 2
 
 
@@ -408,32 +411,41 @@ def game_input():
     return input_str
 
 
-def play():
+def init_game() -> GameState:
     num_sites = int(game_input())
 
     state = GameState()
     for i in range(num_sites):
         site = BuildingSite.from_input(game_input())
         state.add_site(site)
+    return state
+
+
+def play_turn(state: GameState, turns: int):
+    # touched_site: -1 if none
+    # gold, touched_site = [int(i) for i in input().split()]
+    warning(f'TURN {turns}')
+    state.update_from_input()
+    state.print_state()
+
+    info('Choosing queen action')
+    # First line: A valid queen action
+    queen_action = state.queen_action()
+    print(queen_action)
+    info('Choosing train action')
+    # Second line: A set of training instructions
+    train_action = state.train_action()
+    print(train_action)
+
+
+def play():
+    state = init_game()
 
     turns = 0
     # game loop
     while True:
-        # touched_site: -1 if none
-        # gold, touched_site = [int(i) for i in input().split()]
         turns += 1
-        warning(f'TURN {turns}')
-        state.update_from_input()
-        state.print_state()
-
-        info('Choosing queen action')
-        # First line: A valid queen action
-        queen_action = state.queen_action()
-        print(queen_action)
-        info('Choosing train action')
-        # Second line: A set of training instructions
-        train_action = state.train_action()
-        print(train_action)
+        play_turn(state, turns)
 
 
 if __name__ == '__main__':